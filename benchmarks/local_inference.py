@@ -0,0 +1,169 @@
+"""Benchmark: local inference throughput against stub Ollama and llama.cpp servers.
+
+Starts two in-process HTTP servers that mimic `/api/generate` (Ollama) and
+`/completion` (llama.cpp) on a GPU with a fixed number of parallel slots:
+
+- every prompt holds one slot for its prompt-processing + decode time (a batch
+  of n prompts holds n slots),
+- Ollama reloads the model (a fixed load penalty) whenever `num_ctx` changes,
+- llama.cpp skips most prompt processing when `cache_prompt` is set and the slot
+  already holds the same prompt prefix, and accepts a list of prompts as one batch.
+
+It then drives the same prompts through LLMClient one request at a time and
+concurrently with throughput mode off, and concurrently with throughput mode on.
+The "concurrent, mode off" row is the baseline for throughput mode; the
+sequential row shows what a caller that awaits one call at a time gets.
+
+    python -m benchmarks.local_inference --prompts 32 --slots 4
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_COMPLETION = '[\n  {"id": "q1", "type": "essay", "question": "Explain overfitting."}\n\n]'
+
+
+class StubGPU:
+    def __init__(self, slots: int, prompt_seconds: float, decode_seconds: float, load_seconds: float):
+        self.free_slots = slots
+        self.slots_freed = threading.Condition()
+        self.prompt_seconds = prompt_seconds
+        self.decode_seconds = decode_seconds
+        self.load_seconds = load_seconds
+        self.lock = threading.Lock()
+        self.loaded_ctx = None
+        self.slot_prefix = {}
+        self.max_active = 0
+        self.active = 0
+
+    def run(self, seconds: float, slots: int = 1):
+        with self.slots_freed:
+            self.slots_freed.wait_for(lambda: self.free_slots >= slots)
+            self.free_slots -= slots
+            self.active += slots
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(seconds)
+        with self.slots_freed:
+            self.free_slots += slots
+            self.active -= slots
+            self.slots_freed.notify_all()
+
+
+def make_handler(gpu: StubGPU):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if self.path == "/api/generate":
+                num_ctx = payload.get("options", {}).get("num_ctx", 2048)
+                with gpu.lock:
+                    reload = gpu.loaded_ctx != num_ctx
+                    gpu.loaded_ctx = num_ctx
+                if reload:
+                    time.sleep(gpu.load_seconds)
+                gpu.run(gpu.prompt_seconds + gpu.decode_seconds)
+                self._reply({"response": STUB_COMPLETION, "done": True})
+            elif self.path == "/completion":
+                prompts = payload["prompt"] if isinstance(payload["prompt"], list) else [payload["prompt"]]
+                prompt_cost = 0.0
+                for prompt in prompts:
+                    slot = payload.get("id_slot", -1)
+                    cached = payload.get("cache_prompt") and gpu.slot_prefix.get(slot) == prompt[:512]
+                    gpu.slot_prefix[slot] = prompt[:512]
+                    prompt_cost = max(prompt_cost, gpu.prompt_seconds * (0.1 if cached else 1.0))
+                # Each prompt of a batch runs in its own slot, side by side
+                gpu.run(prompt_cost + gpu.decode_seconds, slots=len(prompts))
+                content = STUB_COMPLETION
+                if "\n\n" in payload.get("stop", []):
+                    content = content.split("\n\n")[0]
+                results = [{"content": content, "stop": True} for _ in prompts]
+                self._reply(results if isinstance(payload["prompt"], list) else results[0])
+            else:
+                self.send_error(404)
+
+    return Handler
+
+
+def start_stub(gpu: StubGPU) -> str:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(gpu))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def complete_json(text: str) -> bool:
+    try:
+        json.loads(text)
+        return True
+    except ValueError:
+        return False
+
+
+async def drive(provider, prompts, concurrent: bool):
+    from utils.llm_client import LLMClient
+    from utils.models import LLMConfig
+
+    client = LLMClient(LLMConfig(provider=provider, model_name="stub", temperature=0.2, max_tokens=1024))
+    started = time.monotonic()
+    if concurrent:
+        texts = await asyncio.gather(*[client.generate_text(prompt) for prompt in prompts])
+    else:
+        texts = [await client.generate_text(prompt) for prompt in prompts]
+    elapsed = time.monotonic() - started
+    return elapsed, sum(complete_json(text) for text in texts)
+
+
+async def main(args):
+    gpus = {name: StubGPU(args.slots, args.prompt_seconds, args.decode_seconds, args.load_seconds)
+            for name in ("ollama", "llamacpp")}
+    # utils.constant reads the local base URLs from these variables at import time
+    os.environ["LOCAL_OLLAMA_API_KEY"] = start_stub(gpus["ollama"])
+    os.environ["LOCAL_LLAMACPP_API_KEY"] = start_stub(gpus["llamacpp"])
+    os.environ["LOCAL_PARALLEL"] = str(args.slots)
+
+    from utils.local_inference import local_inference
+    from utils.models import LLMProvider
+
+    template = "You are a university exam question generator.\n" * 20
+    prompts = [f"{template}Generate question set {i}." for i in range(args.prompts)]
+
+    print(f"{args.prompts} prompts, {args.slots} GPU slots")
+    print(f"{'provider':<12}{'mode':<26}{'seconds':>9}{'req/s':>8}{'max active':>12}{'complete JSON':>15}")
+    for provider, name in [(LLMProvider.LOCAL_OLLAMA, "ollama"), (LLMProvider.LOCAL_LLAMACPP, "llamacpp")]:
+        modes = [("sequential, mode off", False, False, False), ("concurrent, mode off", False, True, False),
+                 ("concurrent, throughput", True, True, False)]
+        if provider == LLMProvider.LOCAL_LLAMACPP:
+            modes.append(("concurrent, batched", True, True, True))
+        for label, enabled, concurrent, batched in modes:
+            local_inference.enabled = enabled
+            local_inference.batch_prompts = batched
+            gpus[name].max_active = 0
+            elapsed, complete = await drive(provider, prompts, concurrent)
+            print(f"{name:<12}{label:<26}{elapsed:>9.2f}{len(prompts) / elapsed:>8.1f}"
+                  f"{gpus[name].max_active:>12}{complete:>10}/{len(prompts)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--prompts", type=int, default=32)
+    parser.add_argument("--slots", type=int, default=4)
+    parser.add_argument("--prompt-seconds", type=float, default=0.05)
+    parser.add_argument("--decode-seconds", type=float, default=0.2)
+    parser.add_argument("--load-seconds", type=float, default=1.0)
+    asyncio.run(main(parser.parse_args()))
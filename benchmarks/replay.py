@@ -0,0 +1,400 @@
+"""Replay captured traffic against local provider stand-ins and profile it.
+
+Reads the JSONL written by the traffic capture middleware (TRAFFIC_CAPTURE_ENABLED=true,
+TRAFFIC_CAPTURE_PATH, default requests.jsonl) and re-drives every captured request
+against the app in-process:
+
+- LLM provider HTTP calls are answered by an httpx MockTransport with the recorded
+  responses, matched on provider and prompt, after the recorded provider latency
+  (queueing, cache hits and coalesced waits are left to the app being replayed),
+- embeddings and PDF text come from the recorded values,
+- requests are sent at their original spacing, divided by --speed (provider
+  latency is not scaled),
+- ChromaDB starts empty in a temporary directory, and the question bank and completion
+  cache are off unless asked for, so runs are comparable across versions.
+
+The result is a per-endpoint latency report plus the hottest functions (cProfile or
+pyinstrument), written as JSON so two versions can be compared:
+
+    python -m benchmarks.replay --capture requests.jsonl --speed 10 --report before.json
+    python -m benchmarks.replay --capture requests.jsonl --speed 10 --report after.json --compare before.json
+"""
+
+import argparse
+import asyncio
+import cProfile
+import hashlib
+import importlib
+import json
+import math
+import os
+import pstats
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict, deque
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+PROVIDER_ENV_KEYS = {
+    "gemini": "GEMINI_API_KEY",
+    "openai": "OPENAI_API_KEY",
+    "anthropic": "ANTHROPI_API_KEY",
+    "deepseek": "DEEPSEEK_API_KEY",
+}
+
+
+def load_capture(path: str) -> list:
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if "endpoint" in entry:  # skip lines that are not captured requests
+                records.append(entry)
+    return sorted(records, key=lambda entry: entry["timestamp"])
+
+
+def percentile(values: list, pct: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, math.ceil(pct * len(ordered)) - 1)]
+
+
+def provider_response(provider: str, call: dict) -> dict:
+    """Provider-shaped JSON for a recorded completion (older captures kept the raw response)."""
+    if "response" in call:
+        return call["response"]
+    text = call["text"]
+    if provider == "anthropic":
+        return {"content": [{"type": "text", "text": text}]}
+    if provider in ("openai", "deepseek"):
+        return {"choices": [{"message": {"role": "assistant", "content": text}}]}
+    if provider == "gemini":
+        return {"candidates": [{"content": {"parts": [{"text": text}]}}]}
+    if provider == "local_ollama":
+        return {"response": text, "done": True}
+    return {"content": text, "stop": True}
+
+
+def identify_provider(request) -> tuple:
+    """Return (provider, prompt or list of prompts) for an outgoing provider request."""
+    payload = json.loads(request.content or b"{}")
+    host, path = request.url.host, request.url.path
+    if "anthropic" in host:
+        return "anthropic", payload["messages"][0]["content"]
+    if "openai" in host:
+        return "openai", payload["messages"][0]["content"]
+    if "deepseek" in host:
+        return "deepseek", payload["messages"][0]["content"]
+    if "generativelanguage" in host:
+        return "gemini", payload["contents"][0]["parts"][0]["text"]
+    if path.endswith("/api/generate"):
+        return "local_ollama", payload["prompt"]
+    if path.endswith("/completion"):
+        return "local_llamacpp", payload["prompt"]
+    return None, None
+
+
+class StandIns:
+    """Recorded LLM, embedding and PDF-text responses, served back in place of the real services."""
+
+    def __init__(self, records: list, provider_latency: str):
+        from utils.single_flight import normalize_key
+        self.normalize_key = normalize_key
+        self.provider_latency = provider_latency
+        self.llm = {}
+        self.llm_fifo = defaultdict(deque)
+        self.embeddings = {}
+        self.embedding_dims = Counter()
+        self.pdf_texts = {}
+        self.counts = Counter()
+        for entry in records:
+            for call in entry.get("calls", []):
+                if call["kind"] == "llm":
+                    key = (call["provider"], call["prompt_key"])
+                    known = self.llm.get(key)
+                    # Prefer a call that reached the provider: its latency is the one to reproduce
+                    if known is None or (known.get("source", "provider") != "provider"
+                                         and call.get("source", "provider") == "provider"):
+                        self.llm[key] = call
+                    self.llm_fifo[call["provider"]].append(call)
+                elif call["kind"] == "embedding":
+                    self.embeddings.setdefault((call["provider"], call["text_key"]), call)
+                    self.embedding_dims[len(call["vector"])] += 1
+                elif call["kind"] == "pdf_text":
+                    self.pdf_texts[call["url"]] = call["text"]
+
+    def delay(self, call: dict) -> float:
+        if self.provider_latency != "recorded":
+            return 0.0
+        # Older LLM captures only have the caller-side latency
+        return (call.get("provider_latency_ms", call.get("latency_ms")) or 0) / 1000
+
+    def _llm_call(self, provider: str, prompt: str):
+        call = self.llm.get((provider, self.normalize_key(provider, prompt)))
+        if call is not None:
+            self.counts["llm_hits"] += 1
+            return call
+        # Prompt drifted (e.g. different retrieval context): fall back to recorded order
+        queue = self.llm_fifo.get(provider)
+        if queue:
+            self.counts["llm_fallbacks"] += 1
+            queue.rotate(-1)
+            return queue[-1]
+        self.counts["llm_misses"] += 1
+        return None
+
+    async def handle(self, request):
+        import httpx
+        provider, prompt = identify_provider(request)
+        if provider is None:
+            self.counts["unknown_requests"] += 1
+            return httpx.Response(404, json={"error": f"no stand-in for {request.url}"})
+        prompts = prompt if isinstance(prompt, list) else [prompt]
+        calls = [self._llm_call(provider, p) for p in prompts]
+        if any(call is None for call in calls):
+            return httpx.Response(503, json={"error": f"no recorded {provider} response"})
+        await asyncio.sleep(max(self.delay(call) for call in calls))
+        responses = [provider_response(provider, call) for call in calls]
+        return httpx.Response(200, json=responses if isinstance(prompt, list) else responses[0])
+
+    def embedding(self, provider: str):
+        def embed(text: str) -> list:
+            call = self.embeddings.get((provider, self.normalize_key(text)))
+            if call is not None:
+                self.counts["embedding_hits"] += 1
+                time.sleep(self.delay(call))
+                return call["vector"]
+            # Deterministic pseudo-embedding of the recorded dimension
+            self.counts["embedding_misses"] += 1
+            dims = self.embedding_dims.most_common(1)[0][0] if self.embedding_dims else 768
+            seed = hashlib.sha256(text.encode("utf-8")).digest()
+            return [seed[i % len(seed)] / 255 - 0.5 for i in range(dims)]
+        return embed
+
+    def pdf_text(self, _service, pdf_url: str) -> str:
+        if pdf_url not in self.pdf_texts:
+            self.counts["pdf_misses"] += 1
+            raise ValueError(f"No recorded PDF text for {pdf_url}")
+        self.counts["pdf_hits"] += 1
+        return self.pdf_texts[pdf_url]
+
+
+def install_stand_ins(stand_ins: StandIns):
+    import httpx
+    original_init = httpx.AsyncClient.__init__
+
+    def init(self, *args, **kwargs):
+        # Every client the app creates talks to the stand-ins; the replay driver passes its own transport
+        kwargs.setdefault("transport", httpx.MockTransport(stand_ins.handle))
+        original_init(self, *args, **kwargs)
+
+    httpx.AsyncClient.__init__ = init
+
+
+def patch_app_modules(stand_ins: StandIns):
+    import utils.embedding
+    import utils.course_material_service
+    import utils.question_bank
+    for module in (utils.embedding, utils.course_material_service, utils.question_bank):
+        if hasattr(module, "get_gemini_embedding"):
+            module.get_gemini_embedding = stand_ins.embedding("gemini")
+        if hasattr(module, "get_ollama_embedding"):
+            module.get_ollama_embedding = stand_ins.embedding("ollama")
+    utils.course_material_service.CourseMaterialService._fetch_pdf_text = stand_ins.pdf_text
+
+
+async def drive(app, records: list, speed: float) -> list:
+    import httpx
+    results = []
+    loop = asyncio.get_running_loop()
+    first = records[0]["timestamp"]
+    start = loop.time()
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://replay", timeout=None) as client:
+        async def send(entry):
+            offset = 0.0 if math.isinf(speed) else (entry["timestamp"] - first) / speed
+            await asyncio.sleep(max(0.0, start + offset - loop.time()))
+            url = entry["endpoint"] + (f"?{entry['query_string']}" if entry.get("query_string") else "")
+            started = time.perf_counter()
+            if "body" in entry:
+                response = await client.request(entry["method"], url, json=entry["body"])
+            else:
+                response = await client.request(entry["method"], url, content=entry.get("raw_body", "").encode("utf-8"),
+                                                headers={"content-type": entry.get("content_type", "")})
+            results.append({
+                "endpoint": entry["endpoint"],
+                "status": response.status_code,
+                "latency_ms": (time.perf_counter() - started) * 1000,
+                "recorded_latency_ms": entry.get("latency_ms"),
+                "recorded_status": entry.get("status"),
+            })
+
+        await asyncio.gather(*[send(entry) for entry in records])
+    return results
+
+
+def hot_functions(profile: cProfile.Profile, limit: int) -> dict:
+    stats = pstats.Stats(profile).stats
+    rows = []
+    for (filename, line, function), (_, calls, tottime, cumtime, _) in stats.items():
+        rows.append({
+            "function": f"{os.path.relpath(filename, REPO_ROOT) if filename.startswith(REPO_ROOT) else filename}:{line}({function})",
+            "in_repo": filename.startswith(REPO_ROOT),
+            "calls": calls,
+            "tottime_ms": round(tottime * 1000, 3),
+            "cumtime_ms": round(cumtime * 1000, 3),
+        })
+    by_self = sorted(rows, key=lambda row: row["tottime_ms"], reverse=True)[:limit]
+    repo_by_cumulative = sorted((row for row in rows if row["in_repo"]), key=lambda row: row["cumtime_ms"], reverse=True)[:limit]
+    return {"by_self_time": by_self, "repo_by_cumulative_time": repo_by_cumulative}
+
+
+def build_report(args, results: list, stand_ins: StandIns, hot: dict) -> dict:
+    endpoints = {}
+    for endpoint in sorted({result["endpoint"] for result in results}):
+        rows = [result for result in results if result["endpoint"] == endpoint]
+        latencies = [row["latency_ms"] for row in rows]
+        recorded = [row["recorded_latency_ms"] for row in rows if row["recorded_latency_ms"] is not None]
+        endpoints[endpoint] = {
+            "count": len(rows),
+            "errors": sum(1 for row in rows if row["status"] >= 400),
+            "status_mismatches": sum(1 for row in rows if row["recorded_status"] not in (None, row["status"])),
+            "mean_ms": sum(latencies) / len(latencies),
+            "p50_ms": percentile(latencies, 0.5),
+            "p95_ms": percentile(latencies, 0.95),
+            "p99_ms": percentile(latencies, 0.99),
+            "recorded_p50_ms": percentile(recorded, 0.5),
+            "recorded_p95_ms": percentile(recorded, 0.95),
+        }
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                  capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        revision = None
+    return {
+        "revision": revision,
+        "capture": args.capture,
+        "requests": len(results),
+        "speed": args.speed,
+        "provider_latency": args.provider_latency,
+        "profiler": args.profiler,
+        "endpoints": endpoints,
+        "stand_ins": dict(stand_ins.counts),
+        "hot_functions": hot,
+    }
+
+
+def print_report(report: dict, baseline: dict = None):
+    print(f"\nReplayed {report['requests']} requests at speed {report['speed']} (revision {report['revision']})")
+    header = f"{'endpoint':<36}{'count':>6}{'errors':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'rec p95':>10}"
+    if baseline:
+        header += f"{'Δp50':>9}{'Δp95':>9}"
+    print(header)
+    for endpoint, row in report["endpoints"].items():
+        recorded = f"{row['recorded_p95_ms']:>10.1f}" if row["recorded_p95_ms"] is not None else f"{'-':>10}"
+        line = (f"{endpoint:<36}{row['count']:>6}{row['errors']:>7}{row['p50_ms']:>10.1f}"
+                f"{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}{recorded}")
+        before = (baseline or {}).get("endpoints", {}).get(endpoint)
+        if before:
+            line += (f"{(row['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100:>+8.1f}%"
+                     f"{(row['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100:>+8.1f}%")
+        print(line)
+    print(f"Stand-ins: {report['stand_ins']}")
+
+    hot = report["hot_functions"].get("repo_by_cumulative_time") or []
+    if hot:
+        before = {row["function"]: row for row in (baseline or {}).get("hot_functions", {}).get("repo_by_cumulative_time", [])}
+        print("\nHottest repo functions (cumulative):")
+        for row in hot:
+            delta = ""
+            if row["function"] in before:
+                delta = f"  ({row['cumtime_ms'] - before[row['function']]['cumtime_ms']:+.1f} ms)"
+            print(f"  {row['cumtime_ms']:>10.1f} ms  {row['calls']:>7} calls  {row['function']}{delta}")
+
+
+def main(args):
+    # Resolve paths before moving into the scratch directory
+    args.capture = os.path.abspath(args.capture)
+    args.report = os.path.abspath(args.report)
+    args.compare = os.path.abspath(args.compare) if args.compare else None
+    records = load_capture(args.capture)
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        print(f"No captured requests in {args.capture}")
+        return
+    if args.profiler == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            sys.exit("pyinstrument is not installed (pip install pyinstrument)")
+
+    # Deterministic app configuration, fixed before utils.constant is imported
+    os.environ["TRAFFIC_CAPTURE_ENABLED"] = "false"
+    os.environ["LLM_CACHE_ENABLED"] = "true" if args.completion_cache else "false"
+    os.environ["QUESTION_BANK_ENABLED"] = "true" if args.question_bank else "false"
+    providers = {call["provider"] for entry in records for call in entry.get("calls", []) if call["kind"] == "llm"}
+    for provider in providers:
+        if provider in PROVIDER_ENV_KEYS:
+            os.environ.setdefault(PROVIDER_ENV_KEYS[provider], "replay")
+    workdir = tempfile.mkdtemp(prefix="replay_")
+    os.chdir(workdir)  # ChromaDB and the completion cache start empty here
+
+    stand_ins = StandIns(records, args.provider_latency)
+    install_stand_ins(stand_ins)
+    app = importlib.import_module("main").app
+    patch_app_modules(stand_ins)
+
+    profile = cProfile.Profile() if args.profiler == "cprofile" else None
+    pyinstrument_profiler = Profiler(async_mode="enabled") if args.profiler == "pyinstrument" else None
+
+    if profile:
+        profile.enable()
+    if pyinstrument_profiler:
+        pyinstrument_profiler.start()
+    results = asyncio.run(drive(app, records, args.speed))
+    if profile:
+        profile.disable()
+    hot = hot_functions(profile, args.top) if profile else {}
+    if pyinstrument_profiler:
+        pyinstrument_profiler.stop()
+        html_path = os.path.splitext(args.report)[0] + ".html"
+        with open(html_path, "w", encoding="utf-8") as f:
+            f.write(pyinstrument_profiler.output_html())
+        hot = {"pyinstrument_html": html_path}
+
+    report = build_report(args, results, stand_ins, hot)
+    report_path = args.report
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    print(f"\nReport written to {report_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--capture", default="requests.jsonl", help="captured traffic (JSONL)")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="arrival spacing: 1 = original timing, 10 = ten times closer, inf = all at once")
+    parser.add_argument("--provider-latency", choices=["recorded", "zero"], default="recorded",
+                        help="stand-ins sleep for the recorded provider latency or not at all")
+    parser.add_argument("--profiler", choices=["none", "cprofile", "pyinstrument"], default="cprofile")
+    parser.add_argument("--top", type=int, default=25, help="number of hot functions to report")
+    parser.add_argument("--limit", type=int, default=0, help="replay only the first N captured requests")
+    parser.add_argument("--question-bank", action="store_true", help="keep the question bank on during replay")
+    parser.add_argument("--completion-cache", action="store_true", help="keep the completion cache on during replay")
+    parser.add_argument("--report", default="replay_report.json")
+    parser.add_argument("--compare", help="earlier report to compare against")
+    main(parser.parse_args())
@@ -0,0 +1,82 @@
+"""Load test: interactive question generation latency under concurrent bulk grading.
+
+Runs entirely in-process against a stub provider call (asyncio.sleep), so it needs
+no API keys. Compares interactive p50/p95 latency with and without a bulk-grading
+flood, through the LLMScheduler and through a plain FIFO semaphore (awaiting provider
+calls directly with a fixed connection limit).
+
+    python -m benchmarks.scheduler_load --slots 8 --bulk 400 --interactive 60
+"""
+
+import argparse
+import asyncio
+import time
+from utils.scheduler import LLMScheduler, RequestClass, _percentile
+
+
+async def stub_provider_call(latency: float):
+    await asyncio.sleep(latency)
+
+
+async def run_scenario(acquire_slot, args, with_bulk: bool):
+    interactive_latencies = []
+
+    async def call(request_class, course_id, latency):
+        started = time.monotonic()
+        async with acquire_slot(request_class, course_id):
+            await stub_provider_call(latency)
+        return time.monotonic() - started
+
+    async def bulk_job(i):
+        await call(RequestClass.BULK, "BULK101", args.bulk_latency)
+
+    async def interactive_job(i):
+        await asyncio.sleep(i * args.interactive_interval)
+        interactive_latencies.append(await call(RequestClass.INTERACTIVE, f"COURSE{i % 5}", args.interactive_latency))
+
+    jobs = [interactive_job(i) for i in range(args.interactive)]
+    if with_bulk:
+        jobs += [bulk_job(i) for i in range(args.bulk)]
+    await asyncio.gather(*jobs)
+    return _percentile(interactive_latencies, 0.5), _percentile(interactive_latencies, 0.95)
+
+
+def scheduler_slots(args):
+    scheduler = LLMScheduler(slots=args.slots, max_queue=args.bulk + args.interactive)
+    return scheduler.slot
+
+
+def fifo_slots(args):
+    semaphore = asyncio.Semaphore(args.slots)
+
+    class Slot:
+        def __init__(self, request_class, course_id):
+            pass
+
+        async def __aenter__(self):
+            await semaphore.acquire()
+
+        async def __aexit__(self, *exc):
+            semaphore.release()
+
+    return Slot
+
+
+async def main(args):
+    print(f"slots={args.slots} bulk={args.bulk} interactive={args.interactive}")
+    print(f"{'mode':<12}{'bulk load':<12}{'p50 (s)':>10}{'p95 (s)':>10}")
+    for name, factory in [("fifo", fifo_slots), ("scheduler", scheduler_slots)]:
+        for with_bulk in (False, True):
+            p50, p95 = await run_scenario(factory(args), args, with_bulk)
+            print(f"{name:<12}{'yes' if with_bulk else 'no':<12}{p50:>10.3f}{p95:>10.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--slots", type=int, default=8)
+    parser.add_argument("--bulk", type=int, default=400)
+    parser.add_argument("--interactive", type=int, default=60)
+    parser.add_argument("--interactive-interval", type=float, default=0.05)
+    parser.add_argument("--bulk-latency", type=float, default=0.2)
+    parser.add_argument("--interactive-latency", type=float, default=0.1)
+    asyncio.run(main(parser.parse_args()))
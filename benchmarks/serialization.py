@@ -0,0 +1,80 @@
+"""Benchmark: response serialization time and bytes on the wire for list endpoints.
+
+Compares FastAPI's default path (response_model validation, jsonable_encoder and
+json.dumps via JSONResponse) with the orjson path in utils/responses.py, for
+/generate-questions and /batch-grade-answers payloads of 10, 100 and 1000 items,
+and reports the encoded size uncompressed, gzip and brotli.
+
+    python -m benchmarks.serialization --repeat 20
+"""
+
+import argparse
+import time
+from typing import List
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+from utils.models import GeneratedQuestion, GradingResult
+from utils.responses import _Compressor, brotli, dumps
+
+
+def make_questions(n: int) -> list:
+    return [{
+        "id": f"q{i}",
+        "type": "mcq",
+        "question": f"Which statement about balanced binary search trees is correct (variant {i})?",
+        "options": [{"option": f"Option {j}: searching takes O(log n) time in case {i}", "is_correct": j == 0} for j in range(4)],
+        "expected_answer": None,
+        "mark": 10,
+        "metadata": {"difficulty": "medium", "subject": "Data Structures"},
+    } for i in range(n)]
+
+
+def make_grades(n: int) -> list:
+    return [GradingResult(
+        question_id=f"q{i}",
+        score=7.5,
+        max_score=10,
+        percentage=75.0,
+        feedback="The answer explains overfitting correctly but only names one prevention technique. " * 3,
+        detailed_analysis={"strengths": ["definition", "example"], "improvements": ["regularization", "early stopping"]},
+    ) for i in range(n)]
+
+
+def time_it(fn, repeat: int) -> float:
+    fn()  # warm up
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def default_path(adapter: TypeAdapter, items: list) -> bytes:
+    validated = adapter.validate_python(items)
+    return JSONResponse(content=jsonable_encoder(validated)).body
+
+
+def compressed_size(body: bytes, encoding: str) -> int:
+    compressor = _Compressor(encoding)
+    return len(compressor.compress(body) + compressor.finish())
+
+
+def main(args):
+    print(f"{'payload':<10}{'items':>6}{'default ms':>12}{'orjson ms':>11}{'speedup':>9}"
+          f"{'raw KB':>9}{'gzip KB':>9}{'br KB':>8}")
+    for name, make, model in [("questions", make_questions, GeneratedQuestion), ("grades", make_grades, GradingResult)]:
+        adapter = TypeAdapter(List[model])
+        for n in (10, 100, 1000):
+            items = make(n)
+            default_ms = time_it(lambda: default_path(adapter, items), args.repeat)
+            orjson_ms = time_it(lambda: dumps(items), args.repeat)
+            body = dumps(items)
+            br = f"{compressed_size(body, 'br') / 1024:>8.1f}" if brotli is not None else f"{'n/a':>8}"
+            print(f"{name:<10}{n:>6}{default_ms:>12.2f}{orjson_ms:>11.2f}{default_ms / orjson_ms:>8.1f}x"
+                  f"{len(body) / 1024:>9.1f}{compressed_size(body, 'gzip') / 1024:>9.1f}{br}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    main(parser.parse_args())
@@ -1,12 +1,14 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
+import asyncio
 from fastapi.security import HTTPBearer
 import json
 from datetime import datetime
-from utils.models import GeneratedQuestion, QuestionRequest, GradingRequest, GradingResult, QuestionType, BatchGradingRequest
+from utils.models import GeneratedQuestion, QuestionRequest, GradingRequest, GradingResult, GradingError, QuestionType, BatchGradingRequest
 from utils.llm_client import LLMClient
 from utils.questions_generator import QuestionGenerator
 from utils.course_material_service import CourseMaterialService
-from typing import List
+from typing import List, Union
+from pydantic import TypeAdapter
 from dotenv import load_dotenv
 from fastapi import Form, Body
 
@@ -15,7 +17,19 @@ load_dotenv()
 
 # Request/Response Models
 from utils.grading_service import GradingService
+from utils.grading_cascade import grading_cascade
+from utils.question_bank import QuestionBank
+from utils.single_flight import coalescing_stats
+from utils.completion_cache import completion_cache
+from utils.scheduler import RequestClass, llm_scheduler, scheduled_as
+from utils.local_inference import local_inference
+from utils.model_router import model_router
+from utils.responses import list_response, ndjson_stream, wants_ndjson, NDJSON_MEDIA_TYPE
+from utils.traffic_capture import TrafficCaptureMiddleware
+from utils.deadline import iter_with_deadline, run_with_deadline, record, cancellation_stats
+from utils.constant import GENERATE_QUESTIONS_DEADLINE, BATCH_GRADING_DEADLINE, BATCH_GRADING_CONCURRENCY
 course_material_service = CourseMaterialService()
+question_bank = QuestionBank(course_material_service)
 
 # FastAPI App
 app = FastAPI(
@@ -24,6 +38,8 @@ app = FastAPI(
     version="1.0.0"
 )
 
+app.add_middleware(TrafficCaptureMiddleware)
+
 security = HTTPBearer(auto_error=False)
 
 @app.get("/")
@@ -42,33 +58,137 @@ async def root():
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.now().isoformat()}
 
+GENERATED_QUESTIONS = TypeAdapter(List[GeneratedQuestion])
+
+
 @app.post("/generate-questions", response_model=List[GeneratedQuestion])
-async def generate_questions(request: QuestionRequest):
+async def generate_questions(request: QuestionRequest, http_request: Request):
     print(f"Generating {request.num_questions} questions of types {request.question_types} for topic '{request}'")
     """Generate exam questions using specified LLM provider"""
-    try:
-        llm_client = LLMClient(request.llm_config)
-        generator = QuestionGenerator(llm_client)
-        questions = await generator.generate_questions(request)
-        return questions
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Question generation failed: {str(e)}")
-
-
-@app.post("/batch-grade-answers", response_model=List[GradingResult])
-async def batch_grade_answers(request: BatchGradingRequest):
-    """Grade multiple fill-in-the-blank or Theory question answers using specified LLM provider answers in a single request. Each answer uses the same grading logic as the single endpoint."""
-    results = []
-    for answer in request.answers:
+    async def work():
         try:
-            llm_client = LLMClient(answer.llm_config)
-            grader = GradingService(llm_client)
-            result = await grader.grade_answer(answer)
-            results.append(result)
+            llm_client = LLMClient(request.llm_config)
+            generator = QuestionGenerator(llm_client)
+            questions = await generator.generate_questions(request)
+            # list_response skips response_model validation, so enforce the schema here
+            return GENERATED_QUESTIONS.validate_python(questions)
+        except HTTPException as e:
+            if e.status_code in (503, 504):
+                raise  # overload and timeouts keep their status
+            raise HTTPException(status_code=500, detail=f"Question generation failed: {str(e)}")
         except Exception as e:
-            # Optionally, you can append an error result or skip
-            results.append(HTTPException(status_code=500, detail=f"Answer grading failed: {str(e)}"))
-    return results
+            raise HTTPException(status_code=500, detail=f"Question generation failed: {str(e)}")
+    with scheduled_as(RequestClass.INTERACTIVE, request.course_id):
+        questions = await run_with_deadline(http_request, work, GENERATE_QUESTIONS_DEADLINE)
+    return list_response(http_request, questions)
+
+
+@app.post("/batch-grade-answers", response_model=List[Union[GradingResult, GradingError]],
+          responses={200: {"content": {NDJSON_MEDIA_TYPE: {}},
+                           "description": "Results in request order, or one NDJSON line per answer as it is graded."}})
+async def batch_grade_answers(request: BatchGradingRequest, http_request: Request):
+    """Grade multiple fill-in-the-blank or Theory question answers using specified LLM provider answers in a single request. Each answer uses the same grading logic as the single endpoint.
+
+    An answer that fails to grade is returned as a GradingError item. With `?stream=ndjson`
+    (or `Accept: application/x-ndjson`) each result is sent as soon as it is graded, in completion order.
+    """
+    request_class = RequestClass.BULK if len(request.answers) > 1 else RequestClass.GRADING
+    # Up to BATCH_GRADING_CONCURRENCY answers in flight, so local servers can use their parallel slots
+    semaphore = asyncio.Semaphore(BATCH_GRADING_CONCURRENCY)
+    graded = 0
+
+    async def grade(answer: GradingRequest):
+        nonlocal graded
+        async with semaphore:
+            try:
+                llm_client = LLMClient(answer.llm_config)
+                grader = GradingService(llm_client)
+                with scheduled_as(request_class, answer.course_id):
+                    result = await grader.grade_answer(answer)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                status_code, detail = (e.status_code, e.detail) if isinstance(e, HTTPException) else (500, str(e))
+                result = GradingError(question_id=answer.id, error=f"Answer grading failed: {detail}", status_code=status_code)
+            graded += 1
+            return result
+
+    if wants_ndjson(http_request):
+        async def stream():
+            works = [lambda answer=answer: grade(answer) for answer in request.answers]
+            try:
+                async for _, result in iter_with_deadline(works, BATCH_GRADING_DEADLINE, lambda i: GradingError(
+                        question_id=request.answers[i].id, error="Request deadline exceeded", status_code=504)):
+                    yield result
+            finally:
+                if graded < len(request.answers):
+                    record("batch_answers_skipped", len(request.answers) - graded)
+        return ndjson_stream(http_request, stream())
+
+    async def work():
+        try:
+            return await asyncio.gather(*[grade(answer) for answer in request.answers])
+        except asyncio.CancelledError:
+            record("batch_answers_skipped", len(request.answers) - graded)
+            raise
+    results = await run_with_deadline(http_request, work, BATCH_GRADING_DEADLINE)
+    return list_response(http_request, results)
+
+@app.get("/scheduler/stats")
+async def get_scheduler_stats():
+    """Outbound LLM slot usage, queue depth and wait times per request class."""
+    return llm_scheduler.stats()
+
+@app.get("/local-inference/stats")
+async def get_local_inference_stats():
+    """Throughput-mode counters for local Ollama and llama.cpp servers."""
+    return local_inference.stats()
+
+@app.get("/routing/stats")
+async def get_routing_stats():
+    """Model tiers, routing counters and observed latency/error rate per provider model."""
+    return model_router.stats()
+
+@app.get("/routing/decisions")
+async def get_routing_decisions(limit: int = Query(100, ge=1, le=500)):
+    """Most recent routing decisions, newest last."""
+    return list(model_router.decisions)[-limit:]
+
+@app.get("/cancellation/stats")
+async def get_cancellation_stats():
+    """Work saved by cancelling requests whose client disconnected or whose deadline passed."""
+    return cancellation_stats
+
+@app.get("/coalescing/stats")
+async def get_coalescing_stats():
+    """How many LLM, embedding and retrieval calls were served by an identical in-flight call."""
+    return coalescing_stats()
+
+@app.get("/llm-cache/stats")
+async def llm_cache_stats():
+    """Completion cache hit/miss and eviction counters."""
+    return completion_cache.stats()
+
+@app.get("/question-bank/stats")
+async def question_bank_stats():
+    """Question bank hit/miss counters and background pre-generation status."""
+    return question_bank.stats()
+
+@app.get("/grading-cascade/stats")
+async def grading_cascade_stats():
+    """Tier-1 grading statistics: fraction escalated to the LLM and the last calibration report."""
+    return grading_cascade.stats()
+
+@app.post("/grading-cascade/calibrate")
+async def calibrate_grading_cascade(request: BatchGradingRequest):
+    """Grade a calibration set with both tiers and report how closely tier-1 grades agree with LLM grades."""
+    async def llm_grade(answer: GradingRequest):
+        with scheduled_as(RequestClass.BULK, answer.course_id):
+            return await GradingService(LLMClient(answer.llm_config)).grade_with_llm(answer)
+    try:
+        return await grading_cascade.calibrate(request.answers, llm_grade)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Cascade calibration failed: {str(e)}")
 
 @app.post("/upload-multiple-course-materials")
 async def upload_multiple_course_material(course_id: str = Form(...), pdf_urls: list[str] = Form(...)):
@@ -77,6 +197,10 @@ async def upload_multiple_course_material(course_id: str = Form(...), pdf_urls:
     try:
         formatted_urls= [url.strip() for url in pdf_urls[0].split(',')]
         course_material_service.add_pdfs(course_id, formatted_urls, "gemini" )
+        # New material version: pre-generate the bank pools already in use for this course
+        for pool in question_bank.pools_for_course(course_id):
+            pool_request = QuestionRequest(**pool["request"], question_types=[pool["question_type"]], num_questions=1)
+            QuestionGenerator(LLMClient(pool_request.llm_config)).schedule_top_up(pool_request, pool["question_type"])
         return {"status": "success", "message": "PDFs uploaded and indexed."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to upload course material: {str(e)}")
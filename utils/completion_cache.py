@@ -0,0 +1,137 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from utils.constant import (
+    LLM_CACHE_ENABLED,
+    LLM_CACHE_PATH,
+    LLM_CACHE_TTL_SECONDS,
+    LLM_CACHE_MAX_BYTES,
+    LLM_CACHE_MEMORY_ITEMS,
+)
+
+
+# LLM Completion Cache
+class CompletionCache:
+    """Opt-in cache of LLM completions keyed by a hash of the final provider payload.
+
+    Completions are zlib-compressed in a SQLite file (WAL mode, so several worker
+    processes can share it) with a small in-memory LRU in front. Entries expire after
+    `ttl_seconds`; when the file grows past `max_bytes` the least recently used
+    entries are evicted.
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, enabled: bool = LLM_CACHE_ENABLED,
+                 ttl_seconds: int = LLM_CACHE_TTL_SECONDS, max_bytes: int = LLM_CACHE_MAX_BYTES,
+                 memory_items: int = LLM_CACHE_MEMORY_ITEMS):
+        self.path = path
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writes_since_evict = 0
+        self.counts = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evicted": 0}
+
+    @staticmethod
+    def key_for(provider: str, model_name: str, payload: Dict[str, Any]) -> str:
+        raw = json.dumps({"provider": provider, "model": model_name, "payload": payload}, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                " key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,"
+                " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed_at)")
+            self._conn = conn
+        return self._conn
+
+    def _remember(self, key: str, text: str, created_at: float):
+        self._memory[key] = (text, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None and now - cached[1] <= self.ttl_seconds:
+                self._memory.move_to_end(key)
+                self.counts["memory_hits"] += 1
+                return cached[0]
+            self._memory.pop(key, None)
+
+            conn = self._connect()
+            row = conn.execute("SELECT value, created_at FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                self.counts["misses"] += 1
+                return None
+            conn.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (now, key))
+            text = zlib.decompress(row[0]).decode("utf-8")
+            self._remember(key, text, row[1])
+            self.counts["disk_hits"] += 1
+            return text
+
+    def set(self, key: str, text: str):
+        now = time.time()
+        value = zlib.compress(text.encode("utf-8"))
+        with self._lock:
+            self._remember(key, text, now)
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO completions (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now, now),
+            )
+            self.counts["writes"] += 1
+            self._writes_since_evict += 1
+            if self._writes_since_evict >= 50:
+                self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        self._writes_since_evict = 0
+        expired = conn.execute("DELETE FROM completions WHERE created_at < ?", (now - self.ttl_seconds,)).rowcount
+        self.counts["evicted"] += max(expired, 0)
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+        while total > self.max_bytes:
+            rows = conn.execute("SELECT key, size FROM completions ORDER BY accessed_at LIMIT 100").fetchall()
+            if not rows:
+                break
+            conn.executemany("DELETE FROM completions WHERE key = ?", [(row[0],) for row in rows])
+            total -= sum(row[1] for row in rows)
+            self.counts["evicted"] += len(rows)
+
+    async def aget(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, text: str):
+        await asyncio.to_thread(self.set, key, text)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            **self.counts,
+            "memory_items": len(self._memory),
+            "ttl_seconds": self.ttl_seconds,
+            "max_bytes": self.max_bytes,
+        }
+
+
+completion_cache = CompletionCache()
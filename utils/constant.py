@@ -7,4 +7,74 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 ANTHROPI_API_KEY = os.getenv("ANTHROPI_API_KEY")
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
 LOCAL_OLLAMA_BASE_URL = os.getenv("LOCAL_OLLAMA_API_KEY")
-LOCAL_LLAMACPP_BASE_URL = os.getenv("LOCAL_LLAMACPP_API_KEY")
\ No newline at end of file
+LOCAL_LLAMACPP_BASE_URL = os.getenv("LOCAL_LLAMACPP_API_KEY")
+# Grading cascade (tier-1 scoring before the LLM for essay answers)
+# Off until /grading-cascade/calibrate has been run on real answers and the thresholds tuned
+GRADING_CASCADE_ENABLED = os.getenv("GRADING_CASCADE_ENABLED", "false").lower() == "true"
+GRADING_CASCADE_LOW_THRESHOLD = float(os.getenv("GRADING_CASCADE_LOW_THRESHOLD", "0.2"))
+GRADING_CASCADE_HIGH_THRESHOLD = float(os.getenv("GRADING_CASCADE_HIGH_THRESHOLD", "0.92"))
+GRADING_CASCADE_SIMILARITY_WEIGHT = float(os.getenv("GRADING_CASCADE_SIMILARITY_WEIGHT", "0.6"))
+GRADING_CASCADE_AGREEMENT_TOLERANCE = float(os.getenv("GRADING_CASCADE_AGREEMENT_TOLERANCE", "0.2"))
+GRADING_CASCADE_EMBEDDING_CACHE_SIZE = int(os.getenv("GRADING_CASCADE_EMBEDDING_CACHE_SIZE", "1024"))
+
+# Question bank (pre-generated questions served without an LLM call)
+QUESTION_BANK_ENABLED = os.getenv("QUESTION_BANK_ENABLED", "true").lower() == "true"
+QUESTION_BANK_MIN_STOCK = int(os.getenv("QUESTION_BANK_MIN_STOCK", "20"))
+QUESTION_BANK_TOP_UP_SIZE = int(os.getenv("QUESTION_BANK_TOP_UP_SIZE", "20"))
+QUESTION_BANK_DUPLICATE_DISTANCE = float(os.getenv("QUESTION_BANK_DUPLICATE_DISTANCE", "0.08"))
+# Shared by all worker processes: a question id can be claimed (served) exactly once
+QUESTION_BANK_CLAIMS_PATH = os.getenv("QUESTION_BANK_CLAIMS_PATH", "chroma_db/question_bank_claims.sqlite3")
+
+# LLM completion cache (opt-in, shared by worker processes through one SQLite file)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "false").lower() == "true"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache/completions.sqlite3")
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+LLM_CACHE_MEMORY_ITEMS = int(os.getenv("LLM_CACHE_MEMORY_ITEMS", "1000"))
+
+# Request deadlines and per-stage timeout budgets (seconds)
+GENERATE_QUESTIONS_DEADLINE = float(os.getenv("GENERATE_QUESTIONS_DEADLINE", "300"))
+BATCH_GRADING_DEADLINE = float(os.getenv("BATCH_GRADING_DEADLINE", "900"))
+# Answers of one batch graded at the same time (set to LOCAL_PARALLEL or above for a local GPU server)
+BATCH_GRADING_CONCURRENCY = int(os.getenv("BATCH_GRADING_CONCURRENCY", "4"))
+LLM_STAGE_TIMEOUT = float(os.getenv("LLM_STAGE_TIMEOUT", "240"))
+RETRIEVAL_STAGE_TIMEOUT = float(os.getenv("RETRIEVAL_STAGE_TIMEOUT", "30"))
+EMBEDDING_STAGE_TIMEOUT = float(os.getenv("EMBEDDING_STAGE_TIMEOUT", "20"))
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", "0.5"))
+
+# LLM scheduler (outbound provider slots shared by all requests)
+LLM_SCHEDULER_SLOTS = int(os.getenv("LLM_SCHEDULER_SLOTS", "16"))
+LLM_SCHEDULER_MAX_QUEUE = int(os.getenv("LLM_SCHEDULER_MAX_QUEUE", "200"))
+LLM_SCHEDULER_BULK_MAX_SHARE = float(os.getenv("LLM_SCHEDULER_BULK_MAX_SHARE", "0.75"))
+LLM_SCHEDULER_WEIGHTS = {
+    "interactive": float(os.getenv("LLM_SCHEDULER_WEIGHT_INTERACTIVE", "8")),
+    "grading": float(os.getenv("LLM_SCHEDULER_WEIGHT_GRADING", "4")),
+    "bulk": float(os.getenv("LLM_SCHEDULER_WEIGHT_BULK", "1")),
+}
+
+# Local inference throughput mode (Ollama / llama.cpp)
+LOCAL_THROUGHPUT_MODE = os.getenv("LOCAL_THROUGHPUT_MODE", "true").lower() == "true"
+LOCAL_PARALLEL = int(os.getenv("LOCAL_PARALLEL", "4"))  # match OLLAMA_NUM_PARALLEL / llama-server --parallel
+LOCAL_MAX_CONTEXT = int(os.getenv("LOCAL_MAX_CONTEXT", "32768"))
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+LLAMACPP_BATCH_PROMPTS = os.getenv("LLAMACPP_BATCH_PROMPTS", "false").lower() == "true"
+LLAMACPP_BATCH_WINDOW_MS = float(os.getenv("LLAMACPP_BATCH_WINDOW_MS", "10"))
+
+# Model routing (used when a request does not pin its model / max_tokens)
+# Candidates are "provider:model" lists, tried in order of observed health and latency
+MODEL_ROUTING_ENABLED = os.getenv("MODEL_ROUTING_ENABLED", "true").lower() == "true"
+MODEL_TIER_LIGHT = os.getenv("MODEL_TIER_LIGHT", "gemini:gemini-2.5-flash-lite")
+MODEL_TIER_STANDARD = os.getenv("MODEL_TIER_STANDARD", "gemini:gemini-2.5-flash")
+ROUTER_LIGHT_MAX_ANSWER_WORDS = int(os.getenv("ROUTER_LIGHT_MAX_ANSWER_WORDS", "60"))
+ROUTER_THINKING_HEADROOM = int(os.getenv("ROUTER_THINKING_HEADROOM", "2048"))
+ROUTER_MAX_ERROR_RATE = float(os.getenv("ROUTER_MAX_ERROR_RATE", "0.5"))
+
+# Response encoding for large list payloads
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", "1024"))
+RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "6"))
+RESPONSE_BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", "5"))
+
+# Traffic capture for replay profiling (opt-in)
+TRAFFIC_CAPTURE_ENABLED = os.getenv("TRAFFIC_CAPTURE_ENABLED", "false").lower() == "true"
+TRAFFIC_CAPTURE_PATH = os.getenv("TRAFFIC_CAPTURE_PATH", "requests.jsonl")
+TRAFFIC_CAPTURE_SAMPLE_RATE = float(os.getenv("TRAFFIC_CAPTURE_SAMPLE_RATE", "1.0"))
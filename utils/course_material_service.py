@@ -3,8 +3,13 @@ import chromadb
 from chromadb.config import Settings
 from PyPDF2 import PdfReader
 import tempfile
+import asyncio
+import hashlib
 import os
 from utils.embedding import get_gemini_embedding, get_ollama_embedding
+from utils.single_flight import retrieval_flight
+from utils.deadline import within_stage
+from utils import traffic_capture
 
 
 # RAG Course Material Service
@@ -63,16 +68,7 @@ class CourseMaterialService:
             pdf_url = pdf_urls[i]
             if not pdf_url.lower().endswith(".pdf"):
                 raise ValueError(f"Only PDF links are accepted. Invalid: {pdf_url}")
-            response = requests.get(pdf_url)
-            print(f"Downloading PDF from {pdf_url} for course {response.status_code}")
-            if response.status_code != 200:
-                raise ValueError(f"Failed to download PDF: {pdf_url}")
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-                tmp.write(response.content)
-                tmp_path = tmp.name
-            reader = PdfReader(tmp_path)
-            text = "\n".join(page.extract_text() or "" for page in reader.pages)
-            os.remove(tmp_path)
+            text = self._fetch_pdf_text(pdf_url)
             chunks = split_text(text, max_length=2000)
             for i, chunk in enumerate(chunks):
                 if embedding_provider == "gemini":
@@ -101,6 +97,34 @@ class CourseMaterialService:
         )
         return results
     
+    def _fetch_pdf_text(self, pdf_url: str) -> str:
+        """Download a PDF and extract its text."""
+        response = requests.get(pdf_url)
+        print(f"Downloading PDF from {pdf_url} for course {response.status_code}")
+        if response.status_code != 200:
+            raise ValueError(f"Failed to download PDF: {pdf_url}")
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
+            tmp.write(response.content)
+            tmp_path = tmp.name
+        reader = PdfReader(tmp_path)
+        text = "\n".join(page.extract_text() or "" for page in reader.pages)
+        os.remove(tmp_path)
+        traffic_capture.record("pdf_text", {"url": pdf_url, "text": text})
+        return text
+
+    async def aquery(self, course_id: str, query_text: str=""):
+        """Async retrieval; concurrent identical (course, query) lookups share one query."""
+        return await within_stage("retrieval", lambda: retrieval_flight.do(
+            f"{course_id}|{query_text}", lambda: asyncio.to_thread(self.query, course_id, query_text),
+            cancellable=False), cancellable=False)
+
+    def material_version(self, course_id: str) -> str:
+        """Short fingerprint of the materials currently indexed for a course."""
+        ids = self.collection.get(where={"course_id": course_id}, include=[])["ids"]
+        if not ids:
+            return "none"
+        return hashlib.sha1("|".join(sorted(ids)).encode("utf-8")).hexdigest()[:12]
+
     def delete_course_material(self, course_id: str):
         """Delete all course materials for a specific course."""
         self.collection.delete(where={"course_id": course_id})
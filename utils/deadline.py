@@ -0,0 +1,149 @@
+import asyncio
+import time
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from fastapi import HTTPException, Request
+from utils.constant import LLM_STAGE_TIMEOUT, RETRIEVAL_STAGE_TIMEOUT, EMBEDDING_STAGE_TIMEOUT, DISCONNECT_POLL_INTERVAL
+
+
+STAGE_BUDGETS = {
+    "llm": LLM_STAGE_TIMEOUT,
+    "retrieval": RETRIEVAL_STAGE_TIMEOUT,
+    "embedding": EMBEDDING_STAGE_TIMEOUT,
+}
+
+cancellation_stats: Dict[str, int] = {
+    "requests": 0,
+    "client_disconnects": 0,
+    "deadlines_exceeded": 0,
+    "llm_calls_cancelled": 0,
+    # Embedding and retrieval run in worker threads, which cannot be interrupted: the
+    # request stops waiting, but the call still completes (and is still billed)
+    "embedding_calls_abandoned": 0,
+    "retrieval_calls_abandoned": 0,
+    "batch_answers_skipped": 0,
+}
+
+
+def record(name: str, count: int = 1):
+    cancellation_stats[name] = cancellation_stats.get(name, 0) + count
+
+
+# Request deadline
+class Deadline:
+    """Absolute deadline for one request, split into per-stage timeout budgets."""
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def timeout_for(self, stage: str) -> float:
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise HTTPException(status_code=504, detail=f"Request deadline exceeded before {stage}")
+        return min(STAGE_BUDGETS[stage], remaining)
+
+
+request_deadline: ContextVar[Optional[Deadline]] = ContextVar("request_deadline", default=None)
+
+
+def stage_timeout(stage: str) -> float:
+    """Timeout for a stage: its budget, capped by what is left of the current request deadline."""
+    deadline = request_deadline.get()
+    return deadline.timeout_for(stage) if deadline is not None else STAGE_BUDGETS[stage]
+
+
+def detach_deadline():
+    """Drop the request deadline in the current task (for background work started by a request)."""
+    request_deadline.set(None)
+
+
+async def within_stage(stage: str, work: Callable[[], Awaitable[Any]], cancellable: bool = True) -> Any:
+    """Run `work()` within the stage's budget; count it if the request goes away meanwhile.
+
+    `work` is only called once the budget is known, so an expired deadline raises
+    without leaving an un-awaited coroutine behind. Pass `cancellable=False` for work
+    running in a thread: it is counted as abandoned, not cancelled, because the thread
+    keeps running after the request stops waiting.
+    """
+    timeout = stage_timeout(stage)
+    try:
+        return await asyncio.wait_for(work(), timeout=timeout)
+    except asyncio.TimeoutError:
+        if not cancellable:
+            record(f"{stage}_calls_abandoned")
+        raise HTTPException(status_code=504, detail=f"{stage} timed out")
+    except asyncio.CancelledError:
+        record(f"{stage}_calls_cancelled" if cancellable else f"{stage}_calls_abandoned")
+        raise
+
+
+async def iter_with_deadline(works: List[Callable[[], Awaitable[Any]]], seconds: float,
+                             on_deadline: Callable[[int], Any]) -> AsyncIterator[Tuple[int, Any]]:
+    """Run `works` concurrently under one deadline and yield (index, result) as each finishes.
+
+    For streamed responses: once the deadline passes, the unfinished works are cancelled
+    and `on_deadline(index)` is yielded in their place. If the client disconnects, the
+    server cancels the stream and the unfinished works with it.
+    """
+    record("requests")
+    token = request_deadline.set(Deadline(seconds))
+    try:
+        tasks = {asyncio.ensure_future(work()): index for index, work in enumerate(works)}
+    finally:
+        request_deadline.reset(token)
+
+    loop = asyncio.get_running_loop()
+    expires_at = loop.time() + seconds
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=max(0.0, expires_at - loop.time()),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                record("deadlines_exceeded")
+                for task in pending:
+                    task.cancel()
+                for index in sorted(tasks[task] for task in pending):
+                    yield index, on_deadline(index)
+                return
+            for task in done:
+                yield tasks[task], task.result()
+    except (asyncio.CancelledError, GeneratorExit):
+        record("client_disconnects")
+        raise
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def run_with_deadline(http_request: Request, work: Callable[[], Awaitable[Any]], seconds: float) -> Any:
+    """Run an endpoint's work under a deadline and cancel it as soon as the client disconnects."""
+    record("requests")
+    token = request_deadline.set(Deadline(seconds))
+    try:
+        # The task copies the current context, so the deadline travels with it
+        task = asyncio.ensure_future(work())
+    finally:
+        request_deadline.reset(token)
+
+    loop = asyncio.get_running_loop()
+    expires_at = loop.time() + seconds
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                record("client_disconnects")
+                task.cancel()
+                raise HTTPException(status_code=499, detail="Client disconnected")
+            if loop.time() >= expires_at:
+                record("deadlines_exceeded")
+                task.cancel()
+                raise HTTPException(status_code=504, detail="Request deadline exceeded")
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
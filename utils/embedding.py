@@ -1,8 +1,14 @@
+import asyncio
+import time
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from utils.models import LLMConfig
 from pydantic import SecretStr
 from langchain_ollama import OllamaEmbeddings
 from utils.constant import GEMINI_API_KEY
+from utils.single_flight import embedding_flight
+from utils.deadline import within_stage
+from utils.single_flight import normalize_key
+from utils import traffic_capture
 
 
 
@@ -14,11 +20,37 @@ def get_gemini_embedding(text: str) -> list:
         model="models/embedding-001",
         google_api_key=SecretStr(GEMINI_API_KEY)
     )
-    return embeddings.embed_query(text)
+    started = time.monotonic()
+    vector = embeddings.embed_query(text)
+    _record_embedding("gemini", text, vector, started)
+    return vector
 
 
 def get_ollama_embedding(text: str) -> list:
     embedding = OllamaEmbeddings(
         model="gemma3:latest",
     )
-    return embedding.embed_query(text)
\ No newline at end of file
+    started = time.monotonic()
+    vector = embedding.embed_query(text)
+    _record_embedding("ollama", text, vector, started)
+    return vector
+
+
+def _record_embedding(provider: str, text: str, vector: list, started: float):
+    traffic_capture.record("embedding", {
+        "provider": provider,
+        "text_key": normalize_key(text),
+        "vector": vector,
+        "latency_ms": round((time.monotonic() - started) * 1000, 3),
+    })
+
+
+async def aget_gemini_embedding(text: str) -> list:
+    """Async Gemini embedding; concurrent requests for the same text share one call."""
+    return await within_stage("embedding", lambda: embedding_flight.do(
+        f"gemini|{text}", lambda: asyncio.to_thread(get_gemini_embedding, text), cancellable=False), cancellable=False)
+
+
+async def aget_ollama_embedding(text: str) -> list:
+    return await within_stage("embedding", lambda: embedding_flight.do(
+        f"ollama|{text}", lambda: asyncio.to_thread(get_ollama_embedding, text), cancellable=False), cancellable=False)
@@ -0,0 +1,220 @@
+import asyncio
+import math
+import re
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from utils.models import GradingRequest, GradingResult, QuestionType
+from utils.embedding import aget_gemini_embedding
+from utils.constant import (
+    GRADING_CASCADE_ENABLED,
+    GRADING_CASCADE_LOW_THRESHOLD,
+    GRADING_CASCADE_HIGH_THRESHOLD,
+    GRADING_CASCADE_SIMILARITY_WEIGHT,
+    GRADING_CASCADE_AGREEMENT_TOLERANCE,
+    GRADING_CASCADE_EMBEDDING_CACHE_SIZE,
+)
+
+
+STOPWORDS = {
+    # English
+    "the", "and", "for", "are", "but", "not", "you", "all", "any", "can", "had", "her", "was", "one",
+    "our", "out", "has", "him", "his", "how", "its", "may", "who", "did", "yes", "use", "that", "with",
+    "this", "from", "they", "will", "would", "there", "their", "what", "when", "which", "while", "where",
+    "been", "were", "into", "than", "then", "them", "these", "those", "such", "also", "each", "other",
+    "some", "more", "most", "very", "only", "over", "under", "about", "because", "does", "being",
+    # German
+    "der", "die", "das", "und", "ist", "ein", "eine", "den", "dem", "des", "mit", "für", "von", "auf",
+    "sich", "nicht", "auch", "wird", "sind", "oder", "wenn", "zum", "zur", "bei", "aus",
+}
+
+# Words that flip the meaning of an answer without changing its keywords
+NEGATIONS = {
+    "not", "no", "never", "none", "neither", "nor", "cannot", "isn", "aren", "doesn", "don", "didn",
+    "won", "wasn", "weren", "nicht", "kein", "keine", "keinen", "keinem", "keiner", "nie", "niemals",
+}
+
+
+def _tokens(text: str) -> List[str]:
+    return re.findall(r"\w+", (text or "").lower())
+
+
+def _normalize(text: str) -> str:
+    return " ".join(_tokens(text))
+
+
+def _negations(text: str) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for token in _tokens(text):
+        if token in NEGATIONS:
+            counts[token] = counts.get(token, 0) + 1
+    return counts
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+# Tier-1 grading for essay answers
+class GradingCascade:
+    """Cheap first tier in front of the LLM grader.
+
+    Each THEORY answer is scored with embedding similarity and keyword coverage
+    against the expected answer. Answers in the confident bands (empty, verbatim,
+    clearly off-topic, near-verbatim) are graded here; everything in between is
+    escalated to the LLM. Off by default: embedding cosine values rarely fall
+    far below ~0.5, so the thresholds need tuning with `calibrate` first.
+    """
+
+    def __init__(self,
+                 enabled: bool = GRADING_CASCADE_ENABLED,
+                 low_threshold: float = GRADING_CASCADE_LOW_THRESHOLD,
+                 high_threshold: float = GRADING_CASCADE_HIGH_THRESHOLD,
+                 similarity_weight: float = GRADING_CASCADE_SIMILARITY_WEIGHT,
+                 agreement_tolerance: float = GRADING_CASCADE_AGREEMENT_TOLERANCE,
+                 embed: Callable[[str], Awaitable[List[float]]] = aget_gemini_embedding,
+                 embedding_cache_size: int = GRADING_CASCADE_EMBEDDING_CACHE_SIZE):
+        self.enabled = enabled
+        self.low_threshold = low_threshold
+        self.high_threshold = high_threshold
+        self.similarity_weight = similarity_weight
+        self.agreement_tolerance = agreement_tolerance
+        self.embed = embed
+        self.embedding_cache_size = embedding_cache_size
+        # Expected answers repeat across every student in a batch; their embeddings are kept
+        self._expected_embeddings: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.counts = {"total": 0, "auto_graded": 0, "escalated": 0, "expected_embedding_hits": 0}
+        self.last_calibration: Optional[Dict[str, Any]] = None
+
+    def applies_to(self, request: GradingRequest) -> bool:
+        return self.enabled and request.type == QuestionType.THEORY
+
+    def keyword_coverage(self, expected_answer: str, student_answer: str) -> float:
+        keywords = {t for t in _tokens(expected_answer) if len(t) > 2 and t not in STOPWORDS}
+        if not keywords:
+            return 0.0
+        student = set(_tokens(student_answer))
+        # Cheap stemming: long words match on their first five characters
+        student_stems = {t[:5] for t in student if len(t) > 5}
+        hits = sum(1 for k in keywords if k in student or (len(k) > 5 and k[:5] in student_stems))
+        return hits / len(keywords)
+
+    async def _embed_expected(self, expected_answer: str) -> List[float]:
+        key = _normalize(expected_answer)
+        if key in self._expected_embeddings:
+            self._expected_embeddings.move_to_end(key)
+            self.counts["expected_embedding_hits"] += 1
+            return self._expected_embeddings[key]
+        vector = await self.embed(expected_answer)
+        self._expected_embeddings[key] = vector
+        if len(self._expected_embeddings) > self.embedding_cache_size:
+            self._expected_embeddings.popitem(last=False)
+        return vector
+
+    async def similarity(self, expected_answer: str, student_answer: str) -> Optional[float]:
+        try:
+            expected, student = await asyncio.gather(self._embed_expected(expected_answer), self.embed(student_answer))
+            return _cosine(expected, student)
+        except Exception as e:
+            print(f"Grading cascade: embedding unavailable, escalating ({e})")
+            return None
+
+    async def score(self, request: GradingRequest) -> Dict[str, Any]:
+        """Return the tier-1 signals and the decision for a single answer."""
+        student = _normalize(request.student_answer)
+        expected = _normalize(request.expected_answer)
+
+        if not student:
+            return {"decision": "auto", "reason": "empty", "confidence": 0.0,
+                    "similarity": None, "keyword_coverage": 0.0, "score": 0.0}
+        if student == expected:
+            return {"decision": "auto", "reason": "verbatim", "confidence": 1.0,
+                    "similarity": 1.0, "keyword_coverage": 1.0, "score": float(request.points)}
+
+        coverage = self.keyword_coverage(request.expected_answer, request.student_answer)
+        similarity = await self.similarity(request.expected_answer, request.student_answer)
+        if similarity is None:
+            return {"decision": "escalate", "reason": "no_embedding", "confidence": coverage,
+                    "similarity": None, "keyword_coverage": coverage, "score": None}
+
+        confidence = self.similarity_weight * similarity + (1 - self.similarity_weight) * coverage
+        signals = {"confidence": confidence, "similarity": similarity, "keyword_coverage": coverage}
+        if confidence <= self.low_threshold:
+            return {"decision": "auto", "reason": "off_topic", "score": 0.0, **signals}
+        if confidence >= self.high_threshold:
+            if _negations(request.student_answer) != _negations(request.expected_answer):
+                # Same keywords, possibly the opposite claim
+                return {"decision": "escalate", "reason": "negation", "score": None, **signals}
+            return {"decision": "auto", "reason": "near_verbatim", "score": float(request.points), **signals}
+        return {"decision": "escalate", "reason": "uncertain", "score": None, **signals}
+
+    def to_result(self, request: GradingRequest, tier1: Dict[str, Any]) -> GradingResult:
+        feedback = {
+            "empty": "No answer was provided.",
+            "verbatim": "The answer matches the expected answer.",
+            "near_verbatim": "The answer closely matches the expected answer and covers its key points.",
+            "off_topic": "The answer does not address the question or the key points of the expected answer.",
+        }[tier1["reason"]]
+        return GradingResult(
+            question_id=request.id,
+            score=tier1["score"],
+            max_score=request.points,
+            percentage=(tier1["score"] / request.points) * 100 if request.points else 0.0,
+            feedback=feedback,
+            detailed_analysis={"graded_by": "cascade_tier1", **tier1},
+        )
+
+    async def grade(self, request: GradingRequest) -> Optional[GradingResult]:
+        """Grade the answer at tier 1, or return None if it should go to the LLM."""
+        tier1 = await self.score(request)
+        self.counts["total"] += 1
+        if tier1["decision"] == "escalate":
+            self.counts["escalated"] += 1
+            return None
+        self.counts["auto_graded"] += 1
+        return self.to_result(request, tier1)
+
+    async def calibrate(self, requests: List[GradingRequest],
+                        llm_grade: Callable[[GradingRequest], Awaitable[Any]]) -> Dict[str, Any]:
+        """Grade a calibration set with both tiers and report how closely they agree.
+
+        `llm_grade` must always call the LLM (it bypasses the cascade).
+        """
+        rows = []
+        for request in requests:
+            if request.type != QuestionType.THEORY:
+                continue
+            tier1 = await self.score(request)
+            llm = await llm_grade(request)
+            llm_score = llm.score if isinstance(llm, GradingResult) else float(llm.get("score", 0))
+            rows.append((request, tier1, llm_score))
+
+        auto = [(r, t, s) for r, t, s in rows if t["decision"] == "auto"]
+        agreeing = [1 for r, t, s in auto if abs(t["score"] - s) <= self.agreement_tolerance * r.points]
+        implied = [abs(t["confidence"] * r.points - s) / r.points for r, t, s in rows if r.points]
+        report = {
+            "samples": len(rows),
+            "escalation_rate": (len(rows) - len(auto)) / len(rows) if rows else 0.0,
+            "auto_graded": len(auto),
+            "agreement_rate": len(agreeing) / len(auto) if auto else None,
+            "agreement_tolerance": self.agreement_tolerance,
+            "mean_abs_error_implied": sum(implied) / len(implied) if implied else None,
+            "thresholds": {"low": self.low_threshold, "high": self.high_threshold},
+        }
+        self.last_calibration = report
+        return report
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.counts["total"]
+        return {
+            "enabled": self.enabled,
+            **self.counts,
+            "escalation_rate": self.counts["escalated"] / total if total else 0.0,
+            "thresholds": {"low": self.low_threshold, "high": self.high_threshold,
+                           "similarity_weight": self.similarity_weight},
+            "calibration": self.last_calibration,
+        }
+
+
+grading_cascade = GradingCascade()
@@ -4,32 +4,47 @@ from utils.models import  GradingRequest, GradingResult, QuestionType
 from utils.llm_client import LLMClient
 from utils.utils import grading_prompt_template
 from utils.course_material_service import CourseMaterialService
+from utils.grading_cascade import GradingCascade, grading_cascade
+from utils.model_router import model_router
 
 
 
 # Grading Service
 class GradingService:
-    def __init__(self, llm_client: LLMClient, course_material_service: CourseMaterialService = CourseMaterialService()):
+    def __init__(self, llm_client: LLMClient, course_material_service: CourseMaterialService = CourseMaterialService(),
+                 cascade: GradingCascade = grading_cascade):
         self.llm_client = llm_client
         self.course_material_service = course_material_service
+        self.cascade = cascade
 
     
     async def grade_answer(self, request: GradingRequest) -> GradingResult:
 
         if request.type == QuestionType.MCQ:
             raise HTTPException(status_code=400, detail="MCQ questions don't need LLM grading")
-        
-        prompt = self._create_grading_prompt(request)
-        response = await self.llm_client.generate_text(prompt)
+
+        if self.cascade.applies_to(request):
+            result = await self.cascade.grade(request)
+            if result is not None:
+                return result
+
+        return await self.grade_with_llm(request)
+
+    async def grade_with_llm(self, request: GradingRequest) -> GradingResult:
+        """Grade with the LLM directly, skipping the tier-1 cascade."""
+        prompt = await self._create_grading_prompt(request)
+        config = model_router.route_grading(request, prompt)
+        llm_client = self.llm_client if config == self.llm_client.config else LLMClient(config)
+        response = await llm_client.generate_text(prompt)
         return self._parse_grading_response(response, request.points)
     
-    def _create_grading_prompt(self, request: GradingRequest) -> str:
+    async def _create_grading_prompt(self, request: GradingRequest) -> str:
         question_type_context = {
             QuestionType.GERMAN: "Evaluate the following fill-in-the-blank answer based on how well it answers the question and meaning accuracy.",
             QuestionType.THEORY: "Focus on conceptual understanding, completeness of explanation, accuracy of information, and logical reasoning."
         }
 
-        context = self.course_material_service.query(request.course_id)
+        context = await self.course_material_service.aquery(request.course_id)
 
         prompt = grading_prompt_template.format(
             question_id=request.id,
@@ -52,7 +67,8 @@ class GradingService:
                 cleaned_content = cleaned_content[7:-3]
             
             question_json = json.loads(cleaned_content)
-            return question_json
+            # Batch results are serialized without response_model re-validation
+            return GradingResult.model_validate(question_json)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Failed to parse response: {str(e)}")
         # try:
@@ -1,7 +1,18 @@
 
 from fastapi import  HTTPException
+import time
+import uuid
 import httpx
 from utils.models import LLMConfig, LLMProvider
+from utils.completion_cache import completion_cache
+import asyncio
+from typing import Optional, Tuple
+from utils.deadline import detach_deadline, stage_timeout, within_stage
+from utils.scheduler import SchedulingTicket, llm_scheduler, scheduling_ticket
+from utils.local_inference import local_inference
+from utils.model_router import model_router
+from utils import traffic_capture
+from utils.single_flight import llm_flight, normalize_key
 from utils.constant import GEMINI_API_KEY, OPENAI_API_KEY, ANTHROPI_API_KEY, DEEPSEEK_API_KEY, LOCAL_OLLAMA_BASE_URL, LOCAL_LLAMACPP_BASE_URL
 
 
@@ -47,69 +58,146 @@ class LLMClient:
             self.base_url = f"{LOCAL_LLAMACPP_BASE_URL or 'http://localhost:8080'}/completion"
             self.headers = {"Content-Type": "application/json"}
 
-    async def generate_text(self, prompt: str) -> str: # type: ignore
-        async with httpx.AsyncClient(timeout=50000.0) as client:
+    async def generate_text(self, prompt: str, coalesce: bool = True) -> str: # type: ignore
+        # Identical concurrent prompts with the same model config share one provider call;
+        # callers that need their own completion (e.g. questions that must not be served
+        # twice) opt out with a key no other caller can match
+        key = normalize_key(self.config.model_dump_json(), prompt)
+        if not coalesce:
+            key = f"{key}:{uuid.uuid4().hex}"
+        ticket = SchedulingTicket.current()
+
+        async def shared_call():
+            # Not tied to the first caller: scheduled under the shared ticket (raised by more
+            # urgent callers), and each caller enforces its own deadline below
+            detach_deadline()
+            traffic_capture.detach_capture()  # each caller records its own call below
+            scheduling_ticket.set(ticket)
+            return await self._generate_text(prompt)
+
+        joined = False
+
+        def on_join(shared: SchedulingTicket):
+            nonlocal joined
+            joined = True
+            shared.join(ticket.request_class, ticket.course_id)
+
+        # Before building the awaitable: raises if the request deadline has already passed
+        timeout = stage_timeout("llm")
+        started = time.monotonic()
+        try:
+            text, source, provider_latency_ms = await asyncio.wait_for(
+                llm_flight.do(key, shared_call, state=ticket, on_join=on_join), timeout=timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="llm timed out")
+        # Recorded per caller, so cache hits and coalesced callers are captured too. latency_ms
+        # is what this caller waited (queueing included); provider_latency_ms is the post alone
+        traffic_capture.record("llm", {
+            "provider": self.config.provider.value,
+            "model_name": self.config.model_name,
+            "prompt_key": normalize_key(self.config.provider.value, prompt),
+            "text": text,
+            "source": "coalesced" if joined else source,
+            "latency_ms": round((time.monotonic() - started) * 1000, 3),
+            "provider_latency_ms": provider_latency_ms,
+        })
+        return text
+
+    def _build_payload(self, prompt: str) -> dict:
+        if self.config.provider in [LLMProvider.ANTHROPIC, LLMProvider.OPENAI, LLMProvider.DEEPSEEK]:
+            return {
+                "model": self.config.model_name,
+                "messages": [{"role": "user", "content": prompt}],
+                "temperature": self.config.temperature,
+                "max_tokens": self.config.max_tokens
+            }
+        
+        elif self.config.provider == LLMProvider.GEMINI:
+            payload = {
+                "contents": [{"parts": [{"text": prompt}]}],
+                "generationConfig": {
+                    "temperature": self.config.temperature,
+                    "maxOutputTokens": self.config.max_tokens
+                }
+            }
+            if self.config.thinking_budget is not None:
+                payload["generationConfig"]["thinkingConfig"] = {"thinkingBudget": self.config.thinking_budget}
+            return payload
+        
+        elif self.config.provider == LLMProvider.LOCAL_OLLAMA:
+            return {
+                "model": self.config.model_name,
+                "prompt": prompt,
+                "stream": False,
+                "options": {
+                    "temperature": self.config.temperature,
+                    "num_predict": self.config.max_tokens
+                }
+            }
+        
+        elif self.config.provider == LLMProvider.LOCAL_LLAMACPP:
+            return {
+                "prompt": prompt,
+                "temperature": self.config.temperature,
+                "n_predict": self.config.max_tokens,
+                # No "\n\n" stop: it truncated the multi-paragraph JSON we ask for
+                "stop": ["</s>"]
+            }
+
+    def _extract_text(self, result: dict) -> str:
+        if self.config.provider == LLMProvider.ANTHROPIC:
+            return result["content"][0]["text"]
+        elif self.config.provider in [LLMProvider.OPENAI, LLMProvider.DEEPSEEK]:
+            return result["choices"][0]["message"]["content"]
+        elif self.config.provider == LLMProvider.GEMINI:
+            return result["candidates"][0]["content"]["parts"][0]["text"]
+        elif self.config.provider == LLMProvider.LOCAL_OLLAMA:
+            return result["response"]
+        elif self.config.provider == LLMProvider.LOCAL_LLAMACPP:
+            return result["content"]
+
+    async def _generate_text(self, prompt: str) -> Tuple[str, str, Optional[float]]: # type: ignore
+        """Return the completion, where it came from ("cache" or "provider") and the provider latency in ms."""
+        payload = self._build_payload(prompt)
+        cache_key = None
+        if completion_cache.enabled and self.config.cache_mode != "bypass":
+            cache_key = completion_cache.key_for(self.config.provider.value, self.config.model_name, payload)
+            if self.config.cache_mode == "default":
+                cached = await completion_cache.aget(cache_key)
+                if cached is not None:
+                    return cached, "cache", None
+
+        # Wait for a fair share of the outbound provider slots
+        async with llm_scheduler.slot():
+            timeout = stage_timeout("llm")
+            started = time.monotonic()
             try:
-                if self.config.provider == LLMProvider.ANTHROPIC:
-                    payload = {
-                        "model": self.config.model_name,
-                        "messages": [{"role": "user", "content": prompt}],
-                        "temperature": self.config.temperature,
-                        "max_tokens": self.config.max_tokens
-                    }
-                    response = await client.post(self.base_url, headers=self.headers, json=payload)
-                    result = response.json()
-                    return result["content"][0]["text"]
-                
-                elif self.config.provider in [LLMProvider.OPENAI, LLMProvider.DEEPSEEK]:
-                    payload = {
-                        "model": self.config.model_name,
-                        "messages": [{"role": "user", "content": prompt}],
-                        "temperature": self.config.temperature,
-                        "max_tokens": self.config.max_tokens
-                    }
-                    response = await client.post(self.base_url, headers=self.headers, json=payload)
-                    result = response.json()
-                    return result["choices"][0]["message"]["content"]
-                
-                elif self.config.provider == LLMProvider.GEMINI:
-                    payload = {
-                        "contents": [{"parts": [{"text": prompt}]}],
-                        "generationConfig": {
-                            "temperature": self.config.temperature,
-                            "maxOutputTokens": self.config.max_tokens
-                        }
-                    }
-                    response = await client.post(self.base_url, headers=self.headers, json=payload)
-                    result = response.json()
-                    return result["candidates"][0]["content"]["parts"][0]["text"]
-                
-                elif self.config.provider == LLMProvider.LOCAL_OLLAMA:
-                    payload = {
-                        "model": self.config.model_name,
-                        "prompt": prompt,
-                        "stream": False,
-                        "options": {
-                            "temperature": self.config.temperature,
-                            "num_predict": self.config.max_tokens
-                        }
-                    }
-                    response = await client.post(self.base_url, headers=self.headers, json=payload)
-                    print(f"Response: {response.text.strip()}")
-                    # response = response.text.strip()
-                    result = response.json()
-                    return result["response"]
-                
-                elif self.config.provider == LLMProvider.LOCAL_LLAMACPP:
-                    payload = {
-                        "prompt": prompt,
-                        "temperature": self.config.temperature,
-                        "n_predict": self.config.max_tokens,
-                        "stop": ["</s>", "\n\n"]
-                    }
-                    response = await client.post(self.base_url, headers=self.headers, json=payload)
-                    result = response.json()
-                    return result["content"]
-                    
+                if local_inference.applies_to(self.config.provider):
+                    # Resident models, sized context, llama.cpp slots and pooled connections
+                    payload = local_inference.apply(self.config.provider, self.config.model_name, payload)
+                    result = await within_stage("llm", lambda: local_inference.complete(
+                        self.config.provider, self.base_url, self.headers, payload, timeout=timeout))
+                else:
+                    async with httpx.AsyncClient(timeout=timeout) as client:
+                        # Cancelling this (client disconnect, deadline) closes the provider connection
+                        response = await within_stage(
+                            "llm", lambda: client.post(self.base_url, headers=self.headers, json=payload))
+                        if self.config.provider == LLMProvider.LOCAL_OLLAMA:
+                            print(f"Response: {response.text.strip()}")
+                        result = response.json()
+                text = self._extract_text(result)
+            except HTTPException:
+                model_router.health.record(self.config.provider, self.config.model_name, time.monotonic() - started, ok=False)
+                raise
+            except httpx.TimeoutException as e:
+                model_router.health.record(self.config.provider, self.config.model_name, time.monotonic() - started, ok=False)
+                raise HTTPException(status_code=504, detail=f"LLM API timed out: {e}")
             except Exception as e:
+                model_router.health.record(self.config.provider, self.config.model_name, time.monotonic() - started, ok=False)
                 raise HTTPException(status_code=500, detail=f"LLM API Error: {e}")
+            provider_latency = time.monotonic() - started
+            model_router.health.record(self.config.provider, self.config.model_name, provider_latency, ok=True)
+
+        if cache_key is not None:
+            await completion_cache.aset(cache_key, text)
+        return text, "provider", round(provider_latency * 1000, 3)
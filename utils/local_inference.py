@@ -0,0 +1,207 @@
+import asyncio
+import json
+import math
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Tuple
+import httpx
+from utils.models import LLMProvider
+from utils.model_router import estimate_tokens
+from utils.constant import (
+    LOCAL_THROUGHPUT_MODE,
+    LOCAL_PARALLEL,
+    LOCAL_MAX_CONTEXT,
+    OLLAMA_KEEP_ALIVE,
+    LLAMACPP_BATCH_PROMPTS,
+    LLAMACPP_BATCH_WINDOW_MS,
+)
+
+
+LOCAL_PROVIDERS = (LLMProvider.LOCAL_OLLAMA, LLMProvider.LOCAL_LLAMACPP)
+
+
+class _ServerPool:
+    """Connections and llama.cpp slots for one local inference server."""
+
+    def __init__(self, parallel: int):
+        self.parallel = parallel
+        self.client = httpx.AsyncClient(
+            timeout=None,
+            limits=httpx.Limits(max_connections=parallel, max_keepalive_connections=parallel),
+        )
+        self.slots = asyncio.Semaphore(parallel)
+        # Only one batch gathers several slots at a time, so two half-filled batches never deadlock
+        self.batch_lock = asyncio.Lock()
+        self.free_slots: List[int] = list(range(parallel))
+        self.slot_prefix: Dict[int, str] = {}
+        self.batches: Dict[str, List[Tuple[str, asyncio.Future]]] = {}
+
+    @asynccontextmanager
+    async def hold_slots(self, count: int):
+        """Hold `count` of the server's parallel slots, one per prompt of a batch."""
+        acquired = 0
+        try:
+            async with self.batch_lock:
+                while acquired < count:
+                    await self.slots.acquire()
+                    acquired += 1
+            yield
+        finally:
+            for _ in range(acquired):
+                self.slots.release()
+
+    def take_slot(self, prompt: str) -> Tuple[int, bool]:
+        """Pick a free slot, preferring one whose cached prompt shares our template prefix."""
+        prefix = prompt[:512]
+        for slot in self.free_slots:
+            if self.slot_prefix.get(slot) == prefix:
+                self.free_slots.remove(slot)
+                return slot, True
+        slot = self.free_slots.pop(0)
+        self.slot_prefix[slot] = prefix
+        return slot, False
+
+
+# Local inference throughput mode
+class LocalInference:
+    """Throughput mode for self-hosted Ollama and llama.cpp servers.
+
+    Keeps models resident (`keep_alive`), sizes the context window to the prompt,
+    pins llama.cpp requests to parallel slots with prompt-cache reuse, keeps pooled
+    connections per server and, when enabled, batches concurrent llama.cpp prompts
+    into one `/completion` request.
+    """
+
+    def __init__(self, enabled: bool = LOCAL_THROUGHPUT_MODE, parallel: int = LOCAL_PARALLEL,
+                 max_context: int = LOCAL_MAX_CONTEXT, keep_alive: str = OLLAMA_KEEP_ALIVE,
+                 batch_prompts: bool = LLAMACPP_BATCH_PROMPTS, batch_window_ms: float = LLAMACPP_BATCH_WINDOW_MS):
+        self.enabled = enabled
+        self.parallel = parallel
+        self.max_context = max_context
+        self.keep_alive = keep_alive
+        self.batch_prompts = batch_prompts
+        self.batch_window_ms = batch_window_ms
+        self._pools: Dict[str, _ServerPool] = {}
+        self._context_sizes: Dict[str, int] = {}
+        self.counts = {"requests": 0, "batched_requests": 0, "batched_prompts": 0, "slot_reuse": 0}
+
+    def applies_to(self, provider: LLMProvider) -> bool:
+        return self.enabled and provider in LOCAL_PROVIDERS
+
+    def context_size(self, model_name: str, prompt: str, max_tokens: int) -> int:
+        """Context window for the prompt plus completion, rounded up to a power of two.
+
+        Ollama reloads the model whenever num_ctx changes, so the size per model only
+        ever grows; requests after the first large one reuse the resident model.
+        """
+        needed = estimate_tokens(prompt) + max_tokens
+        size = min(self.max_context, max(2048, 2 ** math.ceil(math.log2(needed))))
+        size = max(size, self._context_sizes.get(model_name, 0))
+        self._context_sizes[model_name] = size
+        return size
+
+    def apply(self, provider: LLMProvider, model_name: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Add residency, context and prompt-cache options to a local provider payload."""
+        if provider == LLMProvider.LOCAL_OLLAMA:
+            options = payload["options"]
+            num_ctx = self.context_size(model_name, payload["prompt"], options["num_predict"])
+            # Never ask for more completion tokens than fit next to the prompt
+            options["num_predict"] = max(256, min(options["num_predict"], num_ctx - estimate_tokens(payload["prompt"])))
+            options["num_ctx"] = num_ctx
+            payload["keep_alive"] = self.keep_alive
+        elif provider == LLMProvider.LOCAL_LLAMACPP:
+            payload["cache_prompt"] = True
+        return payload
+
+    def _pool(self, base_url: str) -> _ServerPool:
+        pool = self._pools.get(base_url)
+        if pool is None:
+            pool = self._pools[base_url] = _ServerPool(self.parallel)
+        return pool
+
+    async def complete(self, provider: LLMProvider, base_url: str, headers: Dict[str, str],
+                       payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Post a local completion through the server's pooled connections and slots."""
+        self.counts["requests"] += 1
+        pool = self._pool(base_url)
+        if provider == LLMProvider.LOCAL_LLAMACPP and self.batch_prompts:
+            return await self._complete_batched(pool, base_url, headers, payload, timeout)
+
+        async with pool.slots:
+            slot = None
+            if provider == LLMProvider.LOCAL_LLAMACPP:
+                slot, reused = pool.take_slot(payload["prompt"])
+                self.counts["slot_reuse"] += int(reused)
+                payload = {**payload, "id_slot": slot}
+            try:
+                response = await pool.client.post(base_url, headers=headers, json=payload, timeout=timeout)
+                response.raise_for_status()
+                return response.json()
+            finally:
+                if slot is not None:
+                    pool.free_slots.append(slot)
+
+    async def _complete_batched(self, pool: _ServerPool, base_url: str, headers: Dict[str, str],
+                                payload: Dict[str, Any], timeout: Optional[float]) -> Dict[str, Any]:
+        # Prompts with identical sampling settings arriving within the window share one request
+        settings = {k: v for k, v in payload.items() if k != "prompt"}
+        key = json.dumps(settings, sort_keys=True)
+        future = asyncio.get_running_loop().create_future()
+        batch = pool.batches.get(key)
+        if batch is None:
+            batch = pool.batches[key] = []
+            # The timer flushes this batch only, even if a newer batch has taken the key by then
+            asyncio.get_running_loop().call_later(
+                self.batch_window_ms / 1000,
+                lambda: self._flush(pool, key, batch, base_url, headers, settings, timeout),
+            )
+        batch.append((payload["prompt"], future))
+        if len(batch) >= pool.parallel:
+            # Detached right away, so a batch never grows past the server's slot count
+            self._flush(pool, key, batch, base_url, headers, settings, timeout)
+        return await future
+
+    def _flush(self, pool: _ServerPool, key: str, batch: List[Tuple[str, asyncio.Future]], base_url: str,
+               headers: Dict[str, str], settings: Dict[str, Any], timeout: Optional[float]):
+        if pool.batches.get(key) is not batch:
+            return  # already flushed
+        del pool.batches[key]
+        asyncio.ensure_future(self._post_batch(pool, batch, base_url, headers, settings, timeout))
+
+    async def _post_batch(self, pool: _ServerPool, batch: List[Tuple[str, asyncio.Future]], base_url: str,
+                          headers: Dict[str, str], settings: Dict[str, Any], timeout: Optional[float]):
+        batch = [(prompt, future) for prompt, future in batch if not future.done()]
+        if not batch:
+            return
+        self.counts["batched_requests"] += 1
+        self.counts["batched_prompts"] += len(batch)
+        try:
+            request = {**settings, "prompt": [prompt for prompt, _ in batch]}
+            # Each prompt of the batch occupies one of the server's parallel slots
+            async with pool.hold_slots(len(batch)):
+                response = await pool.client.post(base_url, headers=headers, json=request, timeout=timeout)
+            response.raise_for_status()
+            results = response.json()
+            if isinstance(results, dict):
+                results = results.get("results", [results])
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+            for _, future in batch[len(results):]:
+                if not future.done():
+                    future.set_exception(ValueError("llama.cpp returned fewer results than prompts"))
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            **self.counts,
+            "parallel": self.parallel,
+            "context_sizes": dict(self._context_sizes),
+            "batch_prompts": self.batch_prompts,
+        }
+
+
+local_inference = LocalInference()
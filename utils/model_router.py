@@ -0,0 +1,212 @@
+import math
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from utils.models import GradingRequest, LLMConfig, LLMProvider, QuestionRequest, QuestionType
+from utils.constant import (
+    GEMINI_API_KEY,
+    OPENAI_API_KEY,
+    ANTHROPI_API_KEY,
+    DEEPSEEK_API_KEY,
+    MODEL_ROUTING_ENABLED,
+    MODEL_TIER_LIGHT,
+    MODEL_TIER_STANDARD,
+    ROUTER_LIGHT_MAX_ANSWER_WORDS,
+    ROUTER_THINKING_HEADROOM,
+    ROUTER_MAX_ERROR_RATE,
+)
+
+
+PROVIDER_KEYS = {
+    LLMProvider.GEMINI: GEMINI_API_KEY,
+    LLMProvider.OPENAI: OPENAI_API_KEY,
+    LLMProvider.ANTHROPIC: ANTHROPI_API_KEY,
+    LLMProvider.DEEPSEEK: DEEPSEEK_API_KEY,
+}
+
+# Completion tokens per generated question, by type (question, options/expected answer, JSON)
+TOKENS_PER_QUESTION = {
+    QuestionType.MCQ: 250,
+    QuestionType.GERMAN: 150,
+    QuestionType.THEORY: 400,
+}
+
+
+# Output token limits by model-name prefix (longest match wins); unknown models keep the
+# previous LLMConfig default
+MODEL_OUTPUT_LIMITS = {
+    "gemini-2.5": 65536,
+    "gemini-2.0": 8192,
+    "gemini-1.5": 8192,
+    "gpt-4o": 16384,
+    "gpt-4.1": 32768,
+    "o3": 100000,
+    "o4-mini": 100000,
+    "claude-3-5-haiku": 8192,
+    "claude-3-5-sonnet": 8192,
+    "claude-3-7-sonnet": 64000,
+    "claude-3-haiku": 4096,
+    "claude-sonnet-4": 64000,
+    "claude-opus-4": 32000,
+    "deepseek-chat": 8192,
+    "deepseek-reasoner": 65536,
+}
+DEFAULT_OUTPUT_LIMIT = 20000
+
+
+def output_limit(model_name: str) -> int:
+    matches = [prefix for prefix in MODEL_OUTPUT_LIMITS if model_name.startswith(prefix)]
+    return MODEL_OUTPUT_LIMITS[max(matches, key=len)] if matches else DEFAULT_OUTPUT_LIMIT
+
+
+def estimate_tokens(text: str) -> int:
+    # ~3.5 characters per token for English/German prose and JSON
+    return math.ceil(len(text) / 3.5)
+
+
+def parse_candidates(spec: str) -> List[Tuple[LLMProvider, str]]:
+    candidates = []
+    for item in spec.split(","):
+        if ":" in item:
+            provider, model_name = item.strip().split(":", 1)
+            candidates.append((LLMProvider(provider), model_name))
+    return candidates
+
+
+class ProviderHealth:
+    """Exponentially weighted latency and error rate per (provider, model)."""
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self._stats: Dict[Tuple[str, str], Dict[str, float]] = {}
+
+    def record(self, provider: LLMProvider, model_name: str, latency: float, ok: bool):
+        stats = self._stats.setdefault((provider.value, model_name), {"latency": latency, "error_rate": 0.0, "calls": 0})
+        stats["calls"] += 1
+        stats["error_rate"] = (1 - self.alpha) * stats["error_rate"] + self.alpha * (0.0 if ok else 1.0)
+        if ok:
+            stats["latency"] = (1 - self.alpha) * stats["latency"] + self.alpha * latency
+
+    def get(self, provider: LLMProvider, model_name: str) -> Optional[Dict[str, float]]:
+        return self._stats.get((provider.value, model_name))
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        return {f"{provider}:{model}": dict(stats) for (provider, model), stats in self._stats.items()}
+
+
+# Cost- and latency-aware model routing
+class ModelRouter:
+    """Pick a model tier and size max_tokens for requests that don't pin them.
+
+    A GradingRequest without an `llm_config` is fully routed: short answers and
+    fill-in-the-blank go to the light tier, everything else to the standard tier, and
+    within a tier the healthiest, fastest candidate wins. When a config is given but
+    `max_tokens` is not, only `max_tokens` is sized. Explicit values are never changed.
+    """
+
+    def __init__(self, enabled: bool = MODEL_ROUTING_ENABLED,
+                 tiers: Optional[Dict[str, List[Tuple[LLMProvider, str]]]] = None,
+                 health: Optional[ProviderHealth] = None):
+        self.enabled = enabled
+        self.tiers = tiers or {
+            "light": parse_candidates(MODEL_TIER_LIGHT),
+            "standard": parse_candidates(MODEL_TIER_STANDARD),
+        }
+        self.health = health or ProviderHealth()
+        self.decisions: Deque[Dict[str, Any]] = deque(maxlen=500)
+        self.counts = {"routed": 0, "sized_only": 0, "pinned": 0}
+
+    def _available(self, provider: LLMProvider) -> bool:
+        return provider not in PROVIDER_KEYS or bool(PROVIDER_KEYS[provider])
+
+    def pick(self, tier: str) -> Optional[Tuple[LLMProvider, str]]:
+        """Healthy candidates first, then lowest observed latency, then configured order."""
+        ranked = []
+        for index, (provider, model_name) in enumerate(self.tiers.get(tier, [])):
+            if not self._available(provider):
+                continue
+            stats = self.health.get(provider, model_name)
+            unhealthy = stats is not None and stats["calls"] >= 5 and stats["error_rate"] > ROUTER_MAX_ERROR_RATE
+            ranked.append((unhealthy, stats["latency"] if stats else 0.0, index, provider, model_name))
+        if not ranked:
+            return None
+        _, _, _, provider, model_name = min(ranked)
+        return provider, model_name
+
+    def _size(self, provider: LLMProvider, model_name: str, completion_tokens: int) -> Dict[str, Any]:
+        """Config update sizing max_tokens (and, for thinking models, the thinking budget)."""
+        # Gemini 2.5 models spend "thinking" tokens out of the same output budget, so the
+        # budget is capped at the headroom we add; otherwise thinking could eat the answer
+        thinking = provider == LLMProvider.GEMINI and "2.5" in model_name
+        headroom = ROUTER_THINKING_HEADROOM if thinking else 0
+        # Never below the estimate, never above what the model can return
+        update: Dict[str, Any] = {"max_tokens": min(max(512, completion_tokens) + headroom, output_limit(model_name))}
+        if thinking:
+            update["thinking_budget"] = headroom
+        return update
+
+    def _record(self, kind: str, config: LLMConfig, mode: str, tier: Optional[str], prompt_tokens: int,
+                completion_tokens: int, **details) -> LLMConfig:
+        self.counts[mode] += 1
+        self.decisions.append({
+            "timestamp": time.time(),
+            "kind": kind,
+            "mode": mode,
+            "tier": tier,
+            "provider": config.provider.value,
+            "model_name": config.model_name,
+            "max_tokens": config.max_tokens,
+            "thinking_budget": config.thinking_budget,
+            "prompt_tokens": prompt_tokens,
+            "estimated_completion_tokens": completion_tokens,
+            **details,
+        })
+        return config
+
+    def route_grading(self, request: GradingRequest, prompt: str) -> LLMConfig:
+        config = request.llm_config
+        prompt_tokens = estimate_tokens(prompt)
+        answer_words = len(request.student_answer.split())
+        # Score, feedback and analysis grow with the answer being discussed
+        completion_tokens = 300 + estimate_tokens(request.student_answer) // 2
+        details = {"question_type": request.type.value, "answer_words": answer_words}
+
+        if not self.enabled:
+            return config
+        if "llm_config" not in request.model_fields_set:
+            tier = "light" if request.type == QuestionType.GERMAN or answer_words <= ROUTER_LIGHT_MAX_ANSWER_WORDS else "standard"
+            choice = self.pick(tier)
+            if choice is not None:
+                provider, model_name = choice
+                config = config.model_copy(update={"provider": provider, "model_name": model_name,
+                                                   **self._size(provider, model_name, completion_tokens)})
+                return self._record("grading", config, "routed", tier, prompt_tokens, completion_tokens, **details)
+        if "max_tokens" not in config.model_fields_set:
+            config = config.model_copy(update=self._size(config.provider, config.model_name, completion_tokens))
+            return self._record("grading", config, "sized_only", None, prompt_tokens, completion_tokens, **details)
+        return self._record("grading", config, "pinned", None, prompt_tokens, completion_tokens, **details)
+
+    def route_generation(self, request: QuestionRequest, question_type: QuestionType, count: int, prompt: str) -> LLMConfig:
+        """Question generation always names its config, so only max_tokens is sized."""
+        config = request.llm_config
+        prompt_tokens = estimate_tokens(prompt)
+        completion_tokens = 200 + count * TOKENS_PER_QUESTION[question_type]
+        details = {"question_type": question_type.value, "num_questions": count}
+
+        if not self.enabled:
+            return config
+        if "max_tokens" not in config.model_fields_set:
+            config = config.model_copy(update=self._size(config.provider, config.model_name, completion_tokens))
+            return self._record("generation", config, "sized_only", None, prompt_tokens, completion_tokens, **details)
+        return self._record("generation", config, "pinned", None, prompt_tokens, completion_tokens, **details)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            **self.counts,
+            "tiers": {tier: [f"{p.value}:{m}" for p, m in candidates] for tier, candidates in self.tiers.items()},
+            "providers": self.health.snapshot(),
+        }
+
+
+model_router = ModelRouter()
@@ -30,6 +30,10 @@ class LLMConfig(BaseModel):
     model_name: str= "gemini-2.5-flash"  # Default model for local LLMs
     temperature: float = 0.7
     max_tokens: int = 20000
+    # Gemini 2.5 thinking tokens (taken out of max_tokens); None leaves the model's default
+    thinking_budget: Optional[int] = None
+    # Completion cache control: "default" reads and writes, "refresh" skips the read, "bypass" skips both
+    cache_mode: Literal["default", "refresh", "bypass"] = "default"
 
 
 class MCQOption(BaseModel):
@@ -46,6 +50,7 @@ class QuestionRequest(BaseModel):
     llm_config: LLMConfig
     additional_context: Optional[str] = None
     mark: int = 10  # Default points for each question
+    use_question_bank: bool = True  # Serve pre-generated questions when the bank has stock
 
 class GeneratedQuestion(BaseModel):
     id: str
@@ -74,5 +79,11 @@ class GradingResult(BaseModel):
     feedback: str
     detailed_analysis: Dict[str, Any]
 
+class GradingError(BaseModel):
+    # Failed item in /batch-grade-answers; the other answers are still graded
+    question_id: str
+    error: str
+    status_code: int
+
 class BatchGradingRequest(BaseModel):
     answers: List[GradingRequest]
@@ -0,0 +1,253 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from utils.models import QuestionRequest, QuestionType
+from utils.course_material_service import CourseMaterialService
+from utils.embedding import get_gemini_embedding
+from utils.deadline import detach_deadline
+from utils.traffic_capture import detach_capture
+from utils.constant import (
+    QUESTION_BANK_ENABLED,
+    QUESTION_BANK_MIN_STOCK,
+    QUESTION_BANK_DUPLICATE_DISTANCE,
+    QUESTION_BANK_CLAIMS_PATH,
+)
+
+
+def bank_key(course_id: str, subject: str, difficulty: str, question_type: QuestionType, mark: int,
+             additional_context: Optional[str], material_version: str) -> str:
+    # Everything that goes into the generation prompt is part of the key
+    context = hashlib.sha1(" ".join((additional_context or "").split()).lower().encode("utf-8")).hexdigest()[:12]
+    raw = "|".join([course_id, subject.strip().lower(), difficulty, question_type.value, str(mark), context,
+                    material_version])
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def as_question_list(parsed: Any) -> List[Dict[str, Any]]:
+    """Normalize a parsed LLM question response into a list of question dicts."""
+    if isinstance(parsed, dict):
+        parsed = parsed.get("questions", [parsed])
+    return [q for q in parsed if isinstance(q, dict) and q.get("question")]
+
+
+class ClaimStore:
+    """Which banked questions have been served, in a SQLite file shared by worker processes.
+
+    Claiming is a single INSERT on the question id, so exactly one caller in one
+    process wins it; the `served` counter in ChromaDB is only a filter hint.
+    """
+
+    def __init__(self, path: str = QUESTION_BANK_CLAIMS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS claims (question_id TEXT PRIMARY KEY, claimed_at REAL NOT NULL)")
+            self._conn = conn
+        return self._conn
+
+    def claim(self, question_id: str) -> bool:
+        """True if this call claimed the question, False if it was already served."""
+        with self._lock:
+            cursor = self._connect().execute(
+                "INSERT OR IGNORE INTO claims (question_id, claimed_at) VALUES (?, ?)", (question_id, time.time()))
+            return cursor.rowcount == 1
+
+
+# Persistent Question Bank
+class QuestionBank:
+    """Pools of generated questions stored in ChromaDB.
+
+    Pools are keyed by everything that shapes the prompt: course_id, subject,
+    difficulty, question type, mark, additional context and course-material version.
+    Each question is stored with its embedding so near-duplicates are not banked
+    twice. Serving a question claims it in a ClaimStore shared by all worker
+    processes, so a banked question is served at most once; freshly generated
+    shortfall questions are never coalesced between requests either. The
+    synchronous methods talk to ChromaDB; request handlers use the `a`-prefixed
+    variants, which run them in a thread.
+    """
+    _instance = None
+
+    def __new__(cls, course_material_service: CourseMaterialService = None):
+        if cls._instance is None:
+            cls._instance = super(QuestionBank, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self, course_material_service: CourseMaterialService = None):
+        if self._initialized:
+            return
+        self.course_material_service = course_material_service or CourseMaterialService()
+        self.collection = self.course_material_service.client.get_or_create_collection(
+            "question_bank", metadata={"hnsw:space": "cosine"}
+        )
+        self.enabled = QUESTION_BANK_ENABLED
+        self.min_stock = QUESTION_BANK_MIN_STOCK
+        self.duplicate_distance = QUESTION_BANK_DUPLICATE_DISTANCE
+        # Pools that have been asked for, so new course materials can re-stock them
+        self.pools: Dict[str, Dict[str, Any]] = {}
+        self._top_ups: Dict[str, asyncio.Task] = {}
+        self.claims = ClaimStore()
+        # Keeps this process's take() calls from racing each other for the same candidates
+        self._take_lock = threading.Lock()
+        self.counts = {"hits": 0, "partial_hits": 0, "misses": 0, "served": 0, "added": 0, "duplicates": 0}
+        self._initialized = True
+
+    def key_for(self, request: QuestionRequest, question_type: QuestionType) -> str:
+        version = self.course_material_service.material_version(request.course_id)
+        return bank_key(request.course_id, request.subject, request.difficulty, question_type, request.mark,
+                        request.additional_context, version)
+
+    async def akey_for(self, request: QuestionRequest, question_type: QuestionType) -> str:
+        return await asyncio.to_thread(self.key_for, request, question_type)
+
+    def pool_id(self, request: QuestionRequest, question_type: QuestionType) -> str:
+        """Identifies a pool regardless of material version."""
+        return bank_key(request.course_id, request.subject, request.difficulty, question_type, request.mark,
+                        request.additional_context, "*")
+
+    def register_pool(self, key: str, request: QuestionRequest, question_type: QuestionType):
+        # One entry per pool regardless of material version; the latest key wins
+        self.pools[self.pool_id(request, question_type)] = {
+            "key": key,
+            "course_id": request.course_id,
+            "question_type": question_type,
+            "request": request.model_dump(exclude={"question_types", "num_questions"}),
+        }
+
+    def pools_for_course(self, course_id: str) -> List[Dict[str, Any]]:
+        return [pool for pool in self.pools.values() if pool["course_id"] == course_id]
+
+    def stock(self, key: str, unseen_only: bool = False, limit: Optional[int] = None) -> int:
+        """Number of questions in a pool, counting at most `limit` (ids only, no payloads)."""
+        where = {"$and": [{"bank_key": key}, {"served": 0}]} if unseen_only else {"bank_key": key}
+        return len(self.collection.get(where=where, limit=limit, include=[])["ids"])
+
+    def take(self, key: str, count: int) -> List[Dict[str, Any]]:
+        """Take up to `count` unseen questions from a pool and mark them served.
+
+        Questions that were already served are never returned; the caller generates
+        whatever is missing and the top-up job refills the pool.
+        """
+        taken = []
+        with self._take_lock:
+            offset = 0
+            while len(taken) < count:
+                page = self.collection.get(where={"$and": [{"bank_key": key}, {"served": 0}]}, limit=count,
+                                           offset=offset, include=["metadatas"])
+                if not page["ids"]:
+                    break
+                offset += len(page["ids"])
+                for entry_id, meta in zip(page["ids"], page["metadatas"]):
+                    # Another worker may have claimed it before its `served` update landed
+                    if len(taken) < count and self.claims.claim(entry_id):
+                        taken.append((entry_id, meta))
+            if taken:
+                self.collection.update(
+                    ids=[entry_id for entry_id, _ in taken],
+                    metadatas=[{**meta, "served": meta["served"] + 1} for _, meta in taken],
+                )
+        if not taken:
+            self.counts["misses"] += 1
+            return []
+        self.counts["hits" if len(taken) == count else "partial_hits"] += 1
+        self.counts["served"] += len(taken)
+        return [self._to_question(entry_id, meta) for entry_id, meta in taken]
+
+    async def atake(self, key: str, count: int) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self.take, key, count)
+
+    def add(self, key: str, questions: List[Dict[str, Any]], served: int = 0) -> List[Dict[str, Any]]:
+        """Store questions in a pool, skipping near-duplicates. Returns the questions with bank ids."""
+        banked = []
+        for question in questions:
+            try:
+                embedding = get_gemini_embedding(question["question"])
+            except Exception as e:
+                print(f"Question bank: could not embed question, not banking it ({e})")
+                banked.append(question)
+                continue
+            if self._is_duplicate(key, embedding):
+                self.counts["duplicates"] += 1
+                continue
+            question_id = f"qb_{uuid.uuid4().hex[:12]}"
+            if served:
+                self.claims.claim(question_id)  # already handed out by the request that generated it
+            metadata = {"bank_key": key, "served": served, "payload": json.dumps(question)}
+            self.collection.add(ids=[question_id], documents=[question["question"]],
+                                metadatas=[metadata], embeddings=[embedding])
+            self.counts["added"] += 1
+            banked.append(self._to_question(question_id, metadata))
+        return banked
+
+    def _is_duplicate(self, key: str, embedding: List[float]) -> bool:
+        if self.stock(key, limit=1) == 0:
+            return False
+        nearest = self.collection.query(query_embeddings=[embedding], where={"bank_key": key},
+                                        n_results=1, include=["distances"])
+        distances = nearest["distances"][0]
+        return bool(distances) and distances[0] <= self.duplicate_distance
+
+    def _to_question(self, question_id: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
+        question = json.loads(metadata["payload"])
+        question["id"] = question_id
+        question["metadata"] = {**question.get("metadata", {}), "question_bank": metadata["bank_key"]}
+        return question
+
+    def add_in_background(self, key: str, questions: List[Dict[str, Any]], served: int = 0):
+        """Bank freshly generated questions without holding up the response that served them."""
+        async def run():
+            detach_deadline()
+            detach_capture()
+            try:
+                await asyncio.to_thread(self.add, key, questions, served)
+            except Exception as e:
+                print(f"Question bank: failed to bank questions for pool {key}: {e}")
+
+        asyncio.create_task(run())
+
+    def needs_top_up(self, key: str) -> bool:
+        return self.stock(key, unseen_only=True, limit=self.min_stock) < self.min_stock
+
+    async def aneeds_top_up(self, key: str) -> bool:
+        return await asyncio.to_thread(self.needs_top_up, key)
+
+    def schedule_top_up(self, pool_id: str, top_up: Callable[[], Awaitable[Any]]):
+        """Run a pool top-up in the background; at most one top-up per pool at a time."""
+        running = self._top_ups.get(pool_id)
+        if running is not None and not running.done():
+            return
+
+        async def run():
+            detach_deadline()
+            detach_capture()
+            try:
+                await top_up()
+            except Exception as e:
+                print(f"Question bank: top-up for pool {pool_id} failed: {e}")
+            finally:
+                self._top_ups.pop(pool_id, None)
+
+        self._top_ups[pool_id] = asyncio.create_task(run())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            **self.counts,
+            "pools": len(self.pools),
+            "top_ups_running": sum(1 for task in self._top_ups.values() if not task.done()),
+        }
@@ -1,19 +1,26 @@
 
 
 from fastapi import HTTPException
+import asyncio
 import json
 from utils.models import GeneratedQuestion, QuestionRequest, QuestionType
 from utils.llm_client import LLMClient
-from typing import List
+from typing import List, Optional
 from utils.utils import prompt_template
 from utils.course_material_service import CourseMaterialService
+from utils.question_bank import QuestionBank, as_question_list
+from utils.scheduler import RequestClass, scheduled_as
+from utils.model_router import model_router
+from utils.constant import QUESTION_BANK_TOP_UP_SIZE
 
 
 # Question Generator Service
 class QuestionGenerator:
-    def __init__(self, llm_client: LLMClient, course_material_service: CourseMaterialService = CourseMaterialService()):
+    def __init__(self, llm_client: LLMClient, course_material_service: CourseMaterialService = CourseMaterialService(),
+                 question_bank: QuestionBank = QuestionBank()):
         self.llm_client = llm_client
         self.course_material_service = course_material_service
+        self.question_bank = question_bank
     
     async def generate_questions(self, request: QuestionRequest) -> List[GeneratedQuestion]:
         questions = []
@@ -21,25 +28,69 @@ class QuestionGenerator:
         # print(f"Generating {request.num_questions} questions of types {request.question_types} for topic '{request.topic}'")
         for question_type in request.question_types:
             # print(f"Generating {question_type.value} questions...")
-            type_questions = await self._generate_questions_by_type(
-                request, question_type, request.num_questions // len(request.question_types)
-            )
+            count = request.num_questions // len(request.question_types)
+            if request.use_question_bank and self.question_bank.enabled:
+                type_questions = await self._serve_from_bank(request, question_type, count)
+            else:
+                type_questions = await self._generate_questions_by_type(request, question_type, count)
             questions.extend(type_questions)
         
         return questions
+
+    async def _serve_from_bank(self, request: QuestionRequest, question_type: QuestionType, count: int) -> List[GeneratedQuestion]:
+        """Serve unseen questions from the bank, generating only the shortfall with the LLM."""
+        key = await self.question_bank.akey_for(request, question_type)
+        self.question_bank.register_pool(key, request, question_type)
+        questions = await self.question_bank.atake(key, count)
+        if len(questions) < count:
+            needed = count - len(questions)
+            fresh = as_question_list(await self._generate_questions_by_type(request, question_type, needed,
+                                                                            for_bank=True))
+            # Anything the LLM returned beyond the shortfall is banked as unseen stock
+            self.question_bank.add_in_background(key, fresh[:needed], served=1)
+            self.question_bank.add_in_background(key, fresh[needed:])
+            questions.extend(fresh[:needed])
+        if await self.question_bank.aneeds_top_up(key):
+            self.schedule_top_up(request, question_type, key=key)
+        return questions
+
+    def schedule_top_up(self, request: QuestionRequest, question_type: QuestionType, size: int = QUESTION_BANK_TOP_UP_SIZE,
+                        key: Optional[str] = None):
+        """Pre-generate questions for a bank pool in the background."""
+        async def top_up():
+            pool_key = key or await self.question_bank.akey_for(request, question_type)
+            self.question_bank.register_pool(pool_key, request, question_type)
+            with scheduled_as(RequestClass.BULK, request.course_id):
+                generated = await self._generate_questions_by_type(request, question_type, size, for_bank=True)
+            await asyncio.to_thread(self.question_bank.add, pool_key, as_question_list(generated))
+
+        self.question_bank.schedule_top_up(self.question_bank.pool_id(request, question_type), top_up)
     
     async def _generate_questions_by_type(self, request: QuestionRequest, 
                                         question_type: QuestionType, 
-                                        count: int) -> List[GeneratedQuestion]:
+                                        count: int, for_bank: bool = False) -> List[GeneratedQuestion]:
+        # for_bank: the questions are banked and served to students, so they must be this
+        # call's own completion rather than one shared with a concurrent identical request
         if question_type == QuestionType.MCQ:
-            return await self._generate_mcq_questions(request, count)
+            return await self._generate_mcq_questions(request, count, for_bank)
         elif question_type == QuestionType.GERMAN:
-            return await self._generate_german_questions(request, count)
+            return await self._generate_german_questions(request, count, for_bank)
         elif question_type == QuestionType.THEORY:
-            return await self._generate_theory_questions(request, count)
+            return await self._generate_theory_questions(request, count, for_bank)
     
-    async def _generate_mcq_questions(self, request: QuestionRequest, count: int) -> List[GeneratedQuestion]:
-        context = self.course_material_service.query(request.course_id, request.subject)
+    async def _generate_text(self, request: QuestionRequest, question_type: QuestionType, count: int, prompt: str,
+                             for_bank: bool = False) -> str:
+        # Size max_tokens to the number and type of questions unless the caller pinned it
+        config = model_router.route_generation(request, question_type, count, prompt)
+        if for_bank:
+            # A cached completion would repeat questions already banked or served
+            config = config.model_copy(update={"cache_mode": "bypass"})
+        llm_client = self.llm_client if config == self.llm_client.config else LLMClient(config)
+        return await llm_client.generate_text(prompt, coalesce=not for_bank)
+
+    async def _generate_mcq_questions(self, request: QuestionRequest, count: int,
+                                      for_bank: bool = False) -> List[GeneratedQuestion]:
+        context = await self.course_material_service.aquery(request.course_id, request.subject)
         prompt = prompt_template.format(
         subject=request.subject,
         question_type=QuestionType.MCQ.value,
@@ -50,14 +101,15 @@ class QuestionGenerator:
         mark=request.mark if request.mark else 10  # Default mark for each question
         )
         
-        response = await self.llm_client.generate_text(prompt)
+        response = await self._generate_text(request, QuestionType.MCQ, count, prompt, for_bank)
         try:
             return self._parse_question_response(response)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Failed to parse MCQ response: {str(e)}")
     
-    async def _generate_german_questions(self, request: QuestionRequest, count: int) -> List[GeneratedQuestion]:
-        context = self.course_material_service.query(request.course_id, request.subject)
+    async def _generate_german_questions(self, request: QuestionRequest, count: int,
+                                         for_bank: bool = False) -> List[GeneratedQuestion]:
+        context = await self.course_material_service.aquery(request.course_id, request.subject)
         prompt = prompt_template.format(
         subject=request.subject,
         question_type=QuestionType.GERMAN.value,
@@ -68,7 +120,7 @@ class QuestionGenerator:
         mark=request.mark if request.mark else 10  # Default mark for each question
         )
         
-        response = await self.llm_client.generate_text(prompt)
+        response = await self._generate_text(request, QuestionType.GERMAN, count, prompt, for_bank)
         try:
             return self._parse_question_response(response)
         except Exception as e:
@@ -76,8 +128,9 @@ class QuestionGenerator:
         # response = await self.llm_client.generate_text(prompt)
         # return self._parse_text_response(response, QuestionType.GERMAN)
     
-    async def _generate_theory_questions(self, request: QuestionRequest, count: int) -> List[GeneratedQuestion]:
-        context = self.course_material_service.query(request.course_id, request.subject)
+    async def _generate_theory_questions(self, request: QuestionRequest, count: int,
+                                         for_bank: bool = False) -> List[GeneratedQuestion]:
+        context = await self.course_material_service.aquery(request.course_id, request.subject)
         print(f"Context {count} {context}")
         prompt = prompt_template.format(
         subject=request.subject,
@@ -89,7 +142,7 @@ class QuestionGenerator:
         mark=request.mark if request.mark else 10  # Default mark for each question
         )
         
-        response = await self.llm_client.generate_text(prompt)
+        response = await self._generate_text(request, QuestionType.THEORY, count, prompt, for_bank)
         try:
             return self._parse_question_response(response)
         except Exception as e:
@@ -103,6 +156,9 @@ class QuestionGenerator:
                 cleaned_content = cleaned_content[7:-3]
             
             question_json = json.loads(cleaned_content)
+            if isinstance(question_json, dict):
+                # Some models wrap the list: {"questions": [...]}
+                question_json = question_json.get("questions", [question_json])
             return question_json
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Failed to parse response: {str(e)}")
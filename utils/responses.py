@@ -0,0 +1,125 @@
+import zlib
+from typing import Any, AsyncIterable, AsyncIterator, Iterable, Iterator, List, Optional
+import orjson
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel
+from utils.constant import RESPONSE_COMPRESSION_MIN_BYTES, RESPONSE_GZIP_LEVEL, RESPONSE_BROTLI_QUALITY
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(obj: Any) -> bytes:
+    return orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick "br" or "gzip" from an Accept-Encoding header, honouring q-values."""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip()] = q
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    ranked = [(accepted.get(name, accepted.get("*", 0.0)), -i, name) for i, name in enumerate(candidates)]
+    q, _, name = max(ranked)
+    return name if q > 0 else None
+
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=RESPONSE_BROTLI_QUALITY)
+            self._flush = self._compressor.finish
+        else:
+            # wbits=31 writes a gzip container
+            self._compressor = zlib.compressobj(RESPONSE_GZIP_LEVEL, zlib.DEFLATED, 31)
+            self._flush = self._compressor.flush
+        self.encoding = encoding
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(data)
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        """Emit everything compressed so far without ending the stream."""
+        if self.encoding == "br":
+            return self._compressor.flush()
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._flush()
+
+
+def _iter_ndjson(items: Iterable[Any], encoding: Optional[str]) -> Iterator[bytes]:
+    compressor = _Compressor(encoding) if encoding else None
+    for item in items:
+        line = dumps(item) + b"\n"
+        chunk = compressor.compress(line) if compressor else line
+        if chunk:
+            yield chunk
+    if compressor:
+        yield compressor.finish()
+
+
+async def _aiter_ndjson(items: AsyncIterable[Any], encoding: Optional[str]) -> AsyncIterator[bytes]:
+    compressor = _Compressor(encoding) if encoding else None
+    async for item in items:
+        line = dumps(item) + b"\n"
+        # Flush per item: the point of streaming is that each line reaches the client now
+        yield compressor.compress(line) + compressor.flush() if compressor else line
+    if compressor:
+        yield compressor.finish()
+
+
+def ndjson_stream(request: Request, items: AsyncIterable[Any]) -> StreamingResponse:
+    """Stream items as NDJSON while they are produced, compressed per Accept-Encoding."""
+    encoding = negotiate_encoding(request.headers.get("accept-encoding", ""))
+    headers = {"Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return StreamingResponse(_aiter_ndjson(items, encoding), media_type=NDJSON_MEDIA_TYPE, headers=headers)
+
+
+def wants_ndjson(request: Request) -> bool:
+    return request.query_params.get("stream") == "ndjson" or NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def list_response(request: Request, items: List[Any]) -> Response:
+    """Serialize a list endpoint's result with orjson, as JSON or NDJSON, compressed per Accept-Encoding.
+
+    Returning a Response directly skips FastAPI's jsonable_encoder and response_model
+    re-validation, which dominate serialization time for large lists, so callers
+    validate `items` against the schema first (a module-level TypeAdapter is cheap).
+    """
+    encoding = negotiate_encoding(request.headers.get("accept-encoding", ""))
+    headers = {"Vary": "Accept-Encoding"}
+    if wants_ndjson(request):
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return StreamingResponse(_iter_ndjson(items, encoding), media_type=NDJSON_MEDIA_TYPE, headers=headers)
+
+    body = dumps(items)
+    if encoding and len(body) >= RESPONSE_COMPRESSION_MIN_BYTES:
+        compressor = _Compressor(encoding)
+        body = compressor.compress(body) + compressor.finish()
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,230 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from enum import Enum
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from fastapi import HTTPException
+from utils.constant import LLM_SCHEDULER_SLOTS, LLM_SCHEDULER_MAX_QUEUE, LLM_SCHEDULER_BULK_MAX_SHARE, LLM_SCHEDULER_WEIGHTS
+
+
+class RequestClass(str, Enum):
+    INTERACTIVE = "interactive"  # question generation for an instructor waiting on the page
+    GRADING = "grading"  # single answers
+    BULK = "bulk"  # batch grading and background pre-generation
+
+
+# Higher is more urgent; a coalesced call runs at the most urgent class among its callers
+URGENCY = {RequestClass.BULK: 0, RequestClass.GRADING: 1, RequestClass.INTERACTIVE: 2}
+
+request_scheduling: ContextVar[Tuple[RequestClass, str]] = ContextVar(
+    "request_scheduling", default=(RequestClass.GRADING, "unknown")
+)
+
+
+class SchedulingTicket:
+    """Request class and course of one LLM call that may be shared by several callers.
+
+    The call is scheduled under the ticket; a more urgent caller that joins it raises
+    the ticket, which moves the call to that caller's queue if it is still waiting.
+    """
+
+    def __init__(self, request_class: RequestClass, course_id: str):
+        self.request_class = request_class
+        self.course_id = course_id
+        self._scheduler: Optional["LLMScheduler"] = None
+        self._waiter: Optional["_Waiter"] = None
+
+    @classmethod
+    def current(cls) -> "SchedulingTicket":
+        return cls(*request_scheduling.get())
+
+    def join(self, request_class: RequestClass, course_id: str):
+        if URGENCY[request_class] <= URGENCY[self.request_class]:
+            return
+        self.request_class, self.course_id = request_class, course_id
+        if self._waiter is not None:
+            self._scheduler.promote(self._waiter, request_class, course_id)
+
+
+# Ticket of the shared LLM call running in this context, if any
+scheduling_ticket: ContextVar[Optional[SchedulingTicket]] = ContextVar("scheduling_ticket", default=None)
+
+
+@contextmanager
+def scheduled_as(request_class: RequestClass, course_id: str):
+    """Tag LLM calls made in this context with a request class and course."""
+    token = request_scheduling.set((request_class, course_id))
+    try:
+        yield
+    finally:
+        request_scheduling.reset(token)
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, math.ceil(pct * len(ordered)) - 1)]
+
+
+class _Waiter:
+    def __init__(self, request_class: RequestClass, course_id: str, future: asyncio.Future):
+        self.request_class = request_class
+        self.course_id = course_id
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.tag = 0.0
+
+
+# Fair LLM scheduler
+class LLMScheduler:
+    """Weighted fair queuing of outbound LLM calls.
+
+    Every (request class, course_id) pair is its own flow. A flow's calls are tagged
+    with virtual finish times that advance by 1/weight of its class, so classes share
+    slots in proportion to their weights and courses within a class share them
+    equally. Bulk work may never hold more than `bulk_max_share` of the slots, and
+    each class queue is bounded so overload is rejected up front. Finish tags at or
+    below the virtual time carry no information and are pruned, so idle flows do not
+    accumulate.
+    """
+
+    def __init__(self, slots: int = LLM_SCHEDULER_SLOTS, max_queue: int = LLM_SCHEDULER_MAX_QUEUE,
+                 bulk_max_share: float = LLM_SCHEDULER_BULK_MAX_SHARE,
+                 weights: Dict[str, float] = LLM_SCHEDULER_WEIGHTS):
+        self.slots = slots
+        self.max_queue = max_queue
+        self.bulk_slots = max(1, int(slots * bulk_max_share))
+        self.weights = {RequestClass(name): weight for name, weight in weights.items()}
+        self._queue: List[Tuple[float, int, _Waiter]] = []
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._flow_finish: Dict[Tuple[RequestClass, str], float] = {}
+        self._in_flight = {request_class: 0 for request_class in RequestClass}
+        self._queued = {request_class: 0 for request_class in RequestClass}
+        self._waits: Dict[RequestClass, Deque[float]] = {request_class: deque(maxlen=1000) for request_class in RequestClass}
+        self.counts = {"admitted": 0, "queued": 0, "rejected": 0, "promoted": 0}
+
+    def _total_in_flight(self) -> int:
+        return sum(self._in_flight.values())
+
+    def _can_run(self, request_class: RequestClass) -> bool:
+        if self._total_in_flight() >= self.slots:
+            return False
+        return request_class != RequestClass.BULK or self._in_flight[RequestClass.BULK] < self.bulk_slots
+
+    def _start(self, waiter: _Waiter):
+        self._in_flight[waiter.request_class] += 1
+        self._waits[waiter.request_class].append(time.monotonic() - waiter.enqueued_at)
+        self.counts["admitted"] += 1
+
+    def _dispatch(self):
+        """Hand free slots to queued waiters in virtual-finish-time order."""
+        skipped = []
+        virtual_time = self._virtual_time
+        while self._queue and self._total_in_flight() < self.slots:
+            tag, seq, waiter = heapq.heappop(self._queue)
+            if waiter.future.done() or tag != waiter.tag:
+                continue  # cancelled while queued, or re-queued by a promotion
+            if not self._can_run(waiter.request_class):
+                skipped.append((tag, seq, waiter))
+                continue
+            self._queued[waiter.request_class] -= 1
+            self._virtual_time = max(self._virtual_time, tag)
+            self._start(waiter)
+            waiter.future.set_result(None)
+        for item in skipped:
+            heapq.heappush(self._queue, item)
+        if self._virtual_time > virtual_time:
+            self._flow_finish = {flow: tag for flow, tag in self._flow_finish.items() if tag > self._virtual_time}
+
+    def _enqueue(self, waiter: _Waiter):
+        flow = (waiter.request_class, waiter.course_id)
+        waiter.tag = max(self._virtual_time, self._flow_finish.get(flow, 0.0)) + 1.0 / self.weights[waiter.request_class]
+        self._flow_finish[flow] = waiter.tag
+        heapq.heappush(self._queue, (waiter.tag, next(self._seq), waiter))
+        self._queued[waiter.request_class] += 1
+
+    async def acquire(self, request_class: RequestClass, course_id: str,
+                      ticket: Optional[SchedulingTicket] = None) -> RequestClass:
+        """Wait for a slot; returns the class the slot was granted under (pass it to `release`)."""
+        waiter = _Waiter(request_class, course_id, asyncio.get_running_loop().create_future())
+        if not self._queue and self._can_run(request_class):
+            self._start(waiter)
+            return request_class
+        if self._queued[request_class] >= self.max_queue:
+            self.counts["rejected"] += 1
+            raise HTTPException(status_code=503, detail=f"LLM scheduler overloaded: {request_class.value} queue is full")
+
+        self._enqueue(waiter)
+        self.counts["queued"] += 1
+        if ticket is not None:
+            ticket._scheduler, ticket._waiter = self, waiter
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release(waiter.request_class)  # slot was granted just as we were cancelled
+            else:
+                self._queued[waiter.request_class] -= 1
+            raise
+        finally:
+            if ticket is not None:
+                ticket._waiter = None
+        return waiter.request_class
+
+    def promote(self, waiter: _Waiter, request_class: RequestClass, course_id: str):
+        """Move a queued waiter to a more urgent class (a coalesced caller joined its call)."""
+        if waiter.future.done():
+            return  # already running
+        self._queued[waiter.request_class] -= 1
+        waiter.request_class, waiter.course_id = request_class, course_id
+        self._enqueue(waiter)  # the old heap entry goes stale
+        self.counts["promoted"] += 1
+        self._dispatch()
+
+    def release(self, request_class: RequestClass):
+        self._in_flight[request_class] -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, request_class: Optional[RequestClass] = None, course_id: Optional[str] = None):
+        """Hold one outbound LLM slot, by default for the current context's ticket or request class and course."""
+        ticket = None
+        if request_class is None:
+            ticket = scheduling_ticket.get()
+            request_class, course_id = (ticket.request_class, ticket.course_id) if ticket else request_scheduling.get()
+        granted = await self.acquire(request_class, course_id, ticket)
+        try:
+            yield
+        finally:
+            self.release(granted)
+
+    def stats(self) -> Dict[str, Any]:
+        classes = {}
+        for request_class in RequestClass:
+            waits = list(self._waits[request_class])
+            classes[request_class.value] = {
+                "queue_depth": self._queued[request_class],
+                "in_flight": self._in_flight[request_class],
+                "wait_p50_seconds": _percentile(waits, 0.5),
+                "wait_p95_seconds": _percentile(waits, 0.95),
+                "weight": self.weights[request_class],
+            }
+        return {
+            **self.counts,
+            "slots": self.slots,
+            "bulk_slots": self.bulk_slots,
+            "max_queue": self.max_queue,
+            "in_flight": self._total_in_flight(),
+            "classes": classes,
+        }
+
+
+llm_scheduler = LLMScheduler()
@@ -0,0 +1,93 @@
+import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+def normalize_key(*parts: str) -> str:
+    """Hash whitespace-normalized key parts so long prompts make compact dict keys."""
+    raw = "\x1f".join(" ".join(str(part).split()) for part in parts)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task, cancellable: bool, state: Any):
+        self.task = task
+        self.cancellable = cancellable
+        self.state = state
+        self.waiters = 0
+
+
+# Request coalescing
+class SingleFlight:
+    """Share one in-flight call between concurrent callers with the same key.
+
+    The first caller starts the work; later callers with the same key await the same
+    task. A waiter that is cancelled only detaches itself; the underlying call is
+    cancelled once every waiter has gone. Calls made with `cancellable=False` (work in
+    a thread, which cannot be stopped) stay registered until they finish instead, so
+    a later caller with the same key joins the running call rather than starting
+    another thread. `state` is kept with the call and handed to `on_join` when a
+    later caller joins it (the LLM layer uses this to share a scheduling ticket).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[str, _Call] = {}
+        self.counts = {"calls": 0, "executed": 0, "coalesced": 0, "cancelled": 0, "abandoned": 0}
+        FLIGHTS.append(self)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]], cancellable: bool = True,
+                 state: Any = None, on_join: Optional[Callable[[Any], None]] = None) -> Any:
+        self.counts["calls"] += 1
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()), cancellable, state)
+            self._calls[key] = call
+            call.task.add_done_callback(lambda task, key=key, call=call: self._finish(key, call))
+            self.counts["executed"] += 1
+        else:
+            self.counts["coalesced"] += 1
+            if on_join is not None:
+                on_join(call.state)
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                if call.cancellable:
+                    # Last waiter gone: nobody will read the result
+                    self._forget(key, call)
+                    call.task.cancel()
+                    self.counts["cancelled"] += 1
+                else:
+                    self.counts["abandoned"] += 1
+
+    def _forget(self, key: str, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def _finish(self, key: str, call: _Call):
+        self._forget(key, call)
+        if not call.task.cancelled():
+            call.task.exception()  # mark retrieved; waiters re-raise it themselves
+
+    def stats(self) -> Dict[str, Any]:
+        calls = self.counts["calls"]
+        return {
+            **self.counts,
+            "in_flight": len(self._calls),
+            "coalesced_rate": self.counts["coalesced"] / calls if calls else 0.0,
+        }
+
+
+FLIGHTS: List[SingleFlight] = []
+
+llm_flight = SingleFlight("llm")
+embedding_flight = SingleFlight("embedding")
+retrieval_flight = SingleFlight("retrieval")
+
+
+def coalescing_stats() -> Dict[str, Any]:
+    return {flight.name: flight.stats() for flight in FLIGHTS}
@@ -0,0 +1,127 @@
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+from utils.constant import TRAFFIC_CAPTURE_ENABLED, TRAFFIC_CAPTURE_PATH, TRAFFIC_CAPTURE_SAMPLE_RATE
+
+try:
+    import fcntl
+except ImportError:  # Windows: rely on the in-process lock only
+    fcntl = None
+
+
+CAPTURED_ENDPOINTS = ("/generate-questions", "/batch-grade-answers", "/upload-multiple-course-materials")
+SECRET_KEYS = {"api_key", "apikey", "authorization", "token", "password", "secret"}
+EMAIL_PATTERN = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+
+# Upstream calls (LLM, embedding, PDF text) made while serving the current captured request
+captured_calls: ContextVar[Optional[List[Dict[str, Any]]]] = ContextVar("captured_calls", default=None)
+
+
+def detach_capture():
+    """Stop recording calls in the current task (for background work started by a request)."""
+    captured_calls.set(None)
+
+
+def record(kind: str, call: Dict[str, Any]):
+    """Attach an upstream response to the request being captured; a no-op otherwise."""
+    calls = captured_calls.get()
+    if calls is not None:
+        calls.append({"kind": kind, **call})
+
+
+def scrub(value: Any) -> Any:
+    """Drop credentials and mask e-mail addresses in a captured request body."""
+    if isinstance(value, dict):
+        return {k: ("[scrubbed]" if k.lower() in SECRET_KEYS else scrub(v)) for k, v in value.items()}
+    if isinstance(value, list):
+        return [scrub(v) for v in value]
+    if isinstance(value, str):
+        return EMAIL_PATTERN.sub("[email]", value)
+    return value
+
+
+# Traffic capture middleware
+class TrafficCaptureMiddleware:
+    """ASGI middleware that appends captured requests to a JSONL file for replay.
+
+    Each line holds the scrubbed request body, its timing and status, and the LLM,
+    embedding and PDF-text responses it needed, so benchmarks/replay.py can re-drive
+    the traffic against local stand-ins.
+    """
+
+    def __init__(self, app, enabled: bool = TRAFFIC_CAPTURE_ENABLED, path: str = TRAFFIC_CAPTURE_PATH,
+                 sample_rate: float = TRAFFIC_CAPTURE_SAMPLE_RATE):
+        self.app = app
+        self.enabled = enabled
+        self.path = path
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if (not self.enabled or scope["type"] != "http" or scope["path"] not in CAPTURED_ENDPOINTS
+                or random.random() >= self.sample_rate):
+            return await self.app(scope, receive, send)
+
+        body = bytearray()
+        status = {"code": None}
+
+        async def capturing_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                body.extend(message.get("body", b""))
+            return message
+
+        async def capturing_send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        calls: List[Dict[str, Any]] = []
+        token = captured_calls.set(calls)
+        started_at = time.time()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, capturing_receive, capturing_send)
+        finally:
+            captured_calls.reset(token)
+            await asyncio.to_thread(self._write, scope, bytes(body), status["code"], started_at,
+                                    time.perf_counter() - started, calls)
+
+    def _write(self, scope, body: bytes, status: Optional[int], started_at: float, latency: float,
+               calls: List[Dict[str, Any]]):
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        content_type = headers.get("content-type", "")
+        entry = {
+            "request_id": uuid.uuid4().hex,
+            "endpoint": scope["path"],
+            "method": scope["method"],
+            "query_string": scope.get("query_string", b"").decode("latin-1"),
+            "timestamp": started_at,
+            "content_type": content_type,
+            "status": status,
+            "latency_ms": round(latency * 1000, 3),
+            "calls": calls,
+        }
+        text = body.decode("utf-8", errors="replace")
+        if content_type.startswith("application/json"):
+            try:
+                entry["body"] = scrub(json.loads(text))
+            except ValueError:
+                entry["raw_body"] = scrub(text)
+        else:
+            entry["raw_body"] = scrub(text)
+
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        try:
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)  # several workers may share the file
+                f.write(line)
+        except OSError as e:
+            print(f"Traffic capture: failed to write {self.path}: {e}")